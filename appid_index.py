@@ -0,0 +1,59 @@
+import os
+from typing import Iterable, Iterator
+
+# number of bits set in every possible byte
+_bits_set = [bin(byte).count("1") for byte in range(256)]
+
+
+class AppidBitmap:
+    """Set of appids stored as one bit per appid.
+
+    Appids are dense-ish integers (a few million at most), so the whole catalog fits in a few hundred KB,
+    and checking if an appid is known doesn't need a round trip to the database.
+    """
+
+    def __init__(self, appids: Iterable[int] = ()):
+        self._bits = bytearray()
+        self._count = 0
+        for appid in appids:
+            self.add(appid)
+
+    def add(self, appid: int):
+        appid = int(appid)
+        byte_index = appid >> 3
+        if byte_index >= len(self._bits):
+            # grow with some slack so consecutive new appids don't reallocate every time
+            self._bits.extend(bytes(byte_index - len(self._bits) + 1 + len(self._bits) // 8))
+        mask = 1 << (appid & 7)
+        if not self._bits[byte_index] & mask:
+            self._bits[byte_index] |= mask
+            self._count += 1
+
+    def __contains__(self, appid) -> bool:
+        appid = int(appid)
+        byte_index = appid >> 3
+        return appid >= 0 and byte_index < len(self._bits) and bool(self._bits[byte_index] & (1 << (appid & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        for byte_index, byte in enumerate(self._bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (byte_index << 3) | bit
+
+    def save(self, path: str):
+        # written next to the old file and then renamed, so a crash never leaves half a snapshot
+        with open(path + ".tmp", "wb") as f:
+            f.write(self._bits)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "AppidBitmap":
+        bitmap = cls()
+        with open(path, "rb") as f:
+            bitmap._bits = bytearray(f.read())
+        bitmap._count = sum(_bits_set[byte] for byte in bitmap._bits)
+        return bitmap
@@ -0,0 +1,284 @@
+"""
+Local stand-in for the Steam endpoints the crawlers use, so their throughput can be measured without spending real quota.
+Point the crawlers to it with STEAM_API_URL and STEAM_STORE_URL.
+
+Served endpoints: /api/appdetails, /appreviews/<appid>, ISteamUser/GetPlayerSummaries, IPlayerService/GetOwnedGames and IStoreService/GetAppList.
+Responses are built from the recordings of record_responses.py when there are some (their ids get replaced by the fake ones),
+or generated otherwise. Either way they only depend on the requested ids, so two runs with the same ids get the same responses.
+"""
+
+import copy
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+# recommendationids are base + position of the app * _max_reviews_per_app + position of the review
+_max_reviews_per_app = 1000
+
+
+def _load_recordings(recordings_dir, endpoint):
+    folder = os.path.join(recordings_dir, endpoint) if recordings_dir is not None else None
+    if folder is None or not os.path.isdir(folder):
+        return []
+    recordings = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".json"):
+            with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                recordings.append(json.load(f))
+    return recordings
+
+
+class FakeSteam:
+    """The responses of a fake catalog of `appids` and a fake player base of `steamids`.
+
+    Args:
+        reviews_per_app (int): reviews of every app, at most 1000
+        games_per_player (int): games owned by every player with a public game list
+        recommendationid_base (int): first recommendationid, so different runs don't write over each other's reviews
+        latency (float): seconds every response takes, plus or minus `jitter` seconds
+        rate_429 (float): fraction of the responses replaced by 429 Too Many Requests
+        rate_502 (float): fraction of the responses replaced by 502 Bad Gateway
+        recordings_dir (str, optional): folder written by record_responses.py
+    """
+
+    def __init__(self, appids: List[int], steamids: List[int], reviews_per_app=300, games_per_player=50, recommendationid_base=1_000_000_000,
+                 latency=0.0, jitter=0.0, rate_429=0.0, rate_502=0.0, recordings_dir: Optional[str] = None, seed=0):
+        if reviews_per_app > _max_reviews_per_app:
+            raise ValueError(f"At most {_max_reviews_per_app} reviews per app are supported")
+        self.set_ids(appids, steamids, recommendationid_base)
+        self.reviews_per_app = reviews_per_app
+        self.games_per_player = games_per_player
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # (endpoint, status) -> number of responses
+        self.stats = Counter()
+
+        self._appdetails_templates = [app["data"] for recording in _load_recordings(recordings_dir, "appdetails")
+                                      for app in recording.values() if app.get("success")]
+        self._review_templates = [review for recording in _load_recordings(recordings_dir, "appreviews") for review in recording.get("reviews", [])]
+        self._player_templates = [player for recording in _load_recordings(recordings_dir, "GetPlayerSummaries")
+                                  for player in recording["response"].get("players", [])]
+        self._owned_game_templates = [game for recording in _load_recordings(recordings_dir, "GetOwnedGames")
+                                      for game in recording["response"].get("games", [])]
+
+    def set_ids(self, appids: List[int], steamids: List[int], recommendationid_base: int):
+        """Replaces the fake catalog and player base, for servers started before their ids are known."""
+        self.appids = list(appids)
+        self.steamids = list(steamids)
+        self.recommendationid_base = recommendationid_base
+        self._app_positions = {appid: position for position, appid in enumerate(self.appids)}
+
+    # responses
+
+    def appdetails(self, appid: str) -> dict:
+        if len(self._appdetails_templates) > 0:
+            data = copy.deepcopy(self._appdetails_templates[int(appid) % len(self._appdetails_templates)])
+        else:
+            rng = random.Random(int(appid))
+            data = {
+                "type": "game",
+                "required_age": rng.choice([0, 0, 0, 16, 18]),
+                "is_free": rng.random() < 0.15,
+                "detailed_description": "Benchmark game. " * rng.randint(20, 200),
+                "short_description": "Benchmark game.",
+                "developers": [f"Benchmark Developer {rng.randint(1, 50)}"],
+                "publishers": [f"Benchmark Publisher {rng.randint(1, 20)}"],
+                "price_overview": {"currency": "USD", "initial": 1999, "final": rng.choice([499, 999, 1999, 2999]), "discount_percent": 0},
+                "platforms": {"windows": True, "mac": rng.random() < 0.3, "linux": rng.random() < 0.2},
+                "categories": [{"id": category_id, "description": f"Benchmark Category {category_id}"} for category_id in rng.sample(range(1, 40), 4)],
+                "genres": [{"id": str(genre_id), "description": f"Benchmark Genre {genre_id}"} for genre_id in rng.sample(range(1, 30), 2)],
+                "achievements": {"total": rng.choice([0, 12, 40])},
+                "release_date": {"coming_soon": False, "date": "1 Jan, 2020"},
+            }
+        data["steam_appid"] = int(appid)
+        data["name"] = f"Benchmark app {appid}"
+        data["type"] = "game"
+        return {appid: {"success": True, "data": data}}
+
+    def _review(self, position: int, index: int) -> dict:
+        rng = random.Random(self.recommendationid_base + position * _max_reviews_per_app + index)
+        # a different stride per app, so the same players review several apps but never the same one twice
+        steamid = self.steamids[(position * 7919 + index) % len(self.steamids)]
+        timestamp = 1577836800 + rng.randint(0, 100_000_000)
+        review = copy.deepcopy(self._review_templates[index % len(self._review_templates)]) if len(self._review_templates) > 0 else {
+            "language": "english",
+            "review": "Benchmark review. " * rng.randint(1, 50),
+            "votes_up": rng.randint(0, 10),
+            "votes_funny": 0,
+            "weighted_vote_score": "0",
+            "comment_count": 0,
+            "voted_up": rng.random() < 0.8,
+            "steam_purchase": rng.random() < 0.9,
+            "received_for_free": rng.random() < 0.05,
+            "written_during_early_access": rng.random() < 0.1,
+            "author": {"num_games_owned": rng.randint(0, 500), "num_reviews": rng.randint(1, 50),
+                       "playtime_forever": rng.randint(0, 10000), "playtime_last_two_weeks": 0, "playtime_at_review": rng.randint(0, 5000)},
+        }
+        review["recommendationid"] = str(self.recommendationid_base + position * _max_reviews_per_app + index)
+        review["author"]["steamid"] = str(steamid)
+        review["author"]["last_played"] = timestamp + rng.randint(0, 1_000_000)
+        review["timestamp_created"] = timestamp
+        review["timestamp_updated"] = timestamp
+        return review
+
+    def appreviews(self, appid: str, query: dict) -> dict:
+        cursor = query.get("cursor", ["*"])[0]
+        per_page = int(query.get("num_per_page", ["100"])[0])
+        page = 0 if cursor == "*" else int(cursor[len("page"):])
+        position = self._app_positions.get(int(appid))
+        num_reviews = self.reviews_per_app if position is not None else 0
+        indices = range(page * per_page, min((page + 1) * per_page, num_reviews))
+        reviews = [self._review(position, index) for index in indices]
+        query_summary = {"num_reviews": len(reviews)}
+        if cursor == "*":
+            # like Steam, only the first page has the totals
+            total_positive = sum(self._review(position, index)["voted_up"] for index in range(num_reviews))
+            query_summary.update({"review_score": 8, "review_score_desc": "Very Positive", "total_positive": total_positive,
+                                  "total_negative": num_reviews - total_positive, "total_reviews": num_reviews})
+        # like Steam, the cursor keeps going after the last review, and that page is empty
+        return {"success": 1, "query_summary": query_summary, "reviews": reviews, "cursor": f"page{page + 1}"}
+
+    def player_summaries(self, steamids: List[str]) -> dict:
+        players = []
+        for steamid in steamids:
+            rng = random.Random(int(steamid))
+            player = copy.deepcopy(self._player_templates[int(steamid) % len(self._player_templates)]) if len(self._player_templates) > 0 else {
+                "profilestate": 1,
+                "commentpermission": 1,
+                "profileurl": f"https://steamcommunity.com/profiles/{steamid}/",
+                "lastlogoff": 1672531200,
+                "primaryclanid": "103582791429521408",
+                "timecreated": 1262304000 + rng.randint(0, 400_000_000),
+                "loccountrycode": rng.choice(["ES", "US", "DE", "BR"]),
+            }
+            player["steamid"] = steamid
+            player["personaname"] = f"benchmark_{steamid[-6:]}"
+            # one in ten profiles is private
+            player["communityvisibilitystate"] = 1 if int(steamid) % 10 == 0 else 3
+            players.append(player)
+        return {"response": {"players": players}}
+
+    def owned_games(self, steamid: str) -> dict:
+        rng = random.Random(int(steamid))
+        # one in twenty public profiles hides its game list
+        if int(steamid) % 20 == 1:
+            return {"response": {}}
+        games = []
+        for i, appid in enumerate(rng.sample(self.appids, min(self.games_per_player, len(self.appids)))):
+            if len(self._owned_game_templates) > 0:
+                game = copy.deepcopy(self._owned_game_templates[(int(steamid) + i) % len(self._owned_game_templates)])
+            else:
+                playtime = rng.choice([0, rng.randint(1, 100), rng.randint(100, 10000)])
+                game = {"playtime_forever": playtime, "playtime_windows_forever": playtime, "playtime_mac_forever": 0, "playtime_linux_forever": 0,
+                        "rtime_last_played": 1577836800 + rng.randint(0, 100_000_000) if playtime > 0 else 0}
+            game["appid"] = appid
+            games.append(game)
+        return {"response": {"game_count": len(games), "games": games}}
+
+    def app_list(self, query: dict) -> dict:
+        last_appid = int(query.get("last_appid", ["0"])[0])
+        max_results = int(query.get("max_results", ["10000"])[0])
+        appids = sorted(appid for appid in self.appids if appid > last_appid)
+        page = [{"appid": appid, "name": f"Benchmark app {appid}", "last_modified": 1672531200, "price_change_number": 0} for appid in appids[:max_results]]
+        response = {"apps": page}
+        if len(appids) > max_results:
+            response.update({"have_more_results": True, "last_appid": page[-1]["appid"]})
+        return {"response": response}
+
+    # serving
+
+    def respond(self, path: str, query: dict):
+        """Returns (endpoint, status, body) for a request."""
+        segments = [segment for segment in path.split("/") if len(segment) > 0]
+        if path.startswith("/api/appdetails"):
+            endpoint, handler = "appdetails", lambda: self.appdetails(query["appids"][0])
+        elif len(segments) == 2 and segments[0] == "appreviews":
+            endpoint, handler = "appreviews", lambda: self.appreviews(segments[1], query)
+        elif path.startswith("/ISteamUser/GetPlayerSummaries/"):
+            endpoint, handler = "GetPlayerSummaries", lambda: self.player_summaries(query["steamids"][0].split(","))
+        elif path.startswith("/IPlayerService/GetOwnedGames/"):
+            endpoint, handler = "GetOwnedGames", lambda: self.owned_games(query["steamid"][0])
+        elif path.startswith("/IStoreService/GetAppList/"):
+            endpoint, handler = "GetAppList", lambda: self.app_list(query)
+        else:
+            return "unknown", 404, b"Not Found"
+        with self._lock:
+            draw = self._random.random()
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        if draw < self.rate_429:
+            return endpoint, 429, b"Too Many Requests"
+        if draw < self.rate_429 + self.rate_502:
+            return endpoint, 502, b"Bad Gateway"
+        return endpoint, 200, json.dumps(handler()).encode("utf-8")
+
+    def start(self, port=0, host="127.0.0.1") -> ThreadingHTTPServer:
+        """Serves the fake endpoints from a daemon thread. With port 0 a free port is used, see server_address."""
+        server = ThreadingHTTPServer((host, port), _FakeSteamHandler)
+        server.daemon_threads = True
+        server.fake_steam = self
+        threading.Thread(target=server.serve_forever, name="fake_steam", daemon=True).start()
+        return server
+
+
+class _FakeSteamHandler(BaseHTTPRequestHandler):
+    # keep-alive, like Steam, so the connection pool of transport.py gets used
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        if "Content-Length" in self.headers:
+            self.rfile.read(int(self.headers["Content-Length"]))
+        url = urlsplit(self.path)
+        fake_steam = self.server.fake_steam
+        endpoint, status, body = fake_steam.respond(url.path, parse_qs(url.query))
+        with fake_steam._lock:
+            fake_steam.stats[(endpoint, status)] += 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8" if status == 200 else "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a fake Steam API for the crawlers, set STEAM_API_URL and STEAM_STORE_URL to its address.")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="Port to listen on.")
+    parser.add_argument("--first-appid", type=int, default=20_000_000, help="First appid of the fake catalog.")
+    parser.add_argument("-a", "--apps", type=int, default=1000, help="Number of apps in the fake catalog.")
+    parser.add_argument("--first-steamid", type=int, default=76561190000000000, help="First steamid of the fake players.")
+    parser.add_argument("-n", "--players", type=int, default=10000, help="Number of fake players.")
+    parser.add_argument("--reviews-per-app", type=int, default=300, help="Reviews of every app.")
+    parser.add_argument("--games-per-player", type=int, default=50, help="Games owned by every player.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every response takes.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random seconds added to or removed from the latency.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of responses that are 429 Too Many Requests.")
+    parser.add_argument("--rate-502", type=float, default=0.0, help="Fraction of responses that are 502 Bad Gateway.")
+    parser.add_argument("-r", "--recordings", default=None, help="Folder with the responses saved by record_responses.py.")
+    args = parser.parse_args()
+    fake_steam = FakeSteam(range(args.first_appid, args.first_appid + args.apps), range(args.first_steamid, args.first_steamid + args.players),
+                           reviews_per_app=args.reviews_per_app, games_per_player=args.games_per_player, latency=args.latency, jitter=args.jitter,
+                           rate_429=args.rate_429, rate_502=args.rate_502, recordings_dir=args.recordings)
+    server = fake_steam.start(args.port)
+    print(f"Fake Steam API listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print(dict(fake_steam.stats))
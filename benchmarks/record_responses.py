@@ -0,0 +1,46 @@
+"""
+This script saves real Steam responses for fake_steam.py, which uses them as templates so the benchmarks parse payloads like the real ones.
+It spends a few requests of the API key in the .env file: per app one appdetails and one appreviews page, per player one GetPlayerSummaries and one GetOwnedGames.
+
+Output layout: <output_dir>/<endpoint>/<appid or steamid>.json, with the whole response body.
+"""
+
+import json
+import os
+import sys
+
+# the crawler modules live in the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transport
+from config import KEY, request_params
+
+
+def _save(output_dir, endpoint, id, response):
+    if response.status_code != 200:
+        print(f"Error {response.status_code} while recording {endpoint} for {id}, skipping")
+        return
+    os.makedirs(os.path.join(output_dir, endpoint), exist_ok=True)
+    with open(os.path.join(output_dir, endpoint, f"{id}.json"), "w", encoding="utf-8") as f:
+        json.dump(json.loads(response.text), f)
+    print(f"Recorded {endpoint} for {id}")
+
+
+def record_responses(output_dir, appids=(), steamids=()):
+    for appid in appids:
+        _save(output_dir, "appdetails", appid, transport.get(transport.STORE_URL + "/api/appdetails", params={"appids": appid, "cc": "us", "l": "english"}))
+        _save(output_dir, "appreviews", appid, transport.get(transport.STORE_URL + "/appreviews/" + str(appid), params={**request_params, "cursor": "*", "json": "1"}))
+    for steamid in steamids:
+        _save(output_dir, "GetPlayerSummaries", steamid, transport.get(transport.API_URL + "/ISteamUser/GetPlayerSummaries/v2/", params={"steamids": steamid, "key": KEY}))
+        _save(output_dir, "GetOwnedGames", steamid, transport.get(transport.API_URL + "/IPlayerService/GetOwnedGames/v1/",
+                                                                  params={"steamid": steamid, "include_appinfo": False, "include_played_free_games": True, "key": KEY}))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Record real Steam responses to be served by the fake Steam API of the benchmarks.")
+    parser.add_argument("output_dir", help="Folder to save the responses to.")
+    parser.add_argument("-a", "--appids", nargs="*", default=[], help="Apps whose appdetails and first page of reviews are recorded.")
+    parser.add_argument("-s", "--steamids", nargs="*", default=[], help="Players with a public profile whose summary and owned games are recorded.")
+    args = parser.parse_args()
+    record_responses(args.output_dir, args.appids, args.steamids)
@@ -0,0 +1,218 @@
+"""
+Throughput benchmarks of the crawlers against the fake Steam API of fake_steam.py, so performance changes can be compared without spending real quota.
+
+Benchmarks, in this order because every one uses the data written by the previous one (it still runs, unmeasured, when only later ones are selected):
+    get_app_data: crawls the fake catalog without reviews (apps/s)
+    process_game_reviews: writes the reviews of every fake app, downloaded beforehand so only the database writes are measured (reviews/s)
+    crawl_player_data: crawls the review authors that process_game_reviews queued (players/s)
+Every benchmark also reports the statements sent to MySQL per item and the requests the fake server answered.
+
+The benchmarks write to a real MySQL database, by default steam_tfg_jgg_bench (--db-name), created from database_final_schema.sql beforehand.
+Never point them to the crawler's database. Every run uses the block of fake ids after the last one written to it, so runs don't depend on what previous ones wrote.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from fake_steam import FakeSteam
+
+# the crawler modules live in the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ids of a run: a block of appids above the real ones, and steamids below the first real one (76561197960265728)
+_first_appid = 20_000_000
+_appids_per_run = 10_000
+_first_steamid = 76561190000000000
+_steamids_per_run = 1_000_000
+_first_recommendationid = 1_000_000_000
+_recommendationids_per_run = 1_000_000
+# the recommendationid column is a signed int
+_max_runs = 1000
+
+
+def _configure_crawlers(server_url, db_name, work_dir):
+    # decouple reads the environment before the .env file, so this has to happen before the crawler modules are imported
+    os.environ.update({
+        "STEAM_API_URL": server_url,
+        "STEAM_STORE_URL": server_url,
+        "STEAM_API_KEYS": "benchmark",
+        "DB_NAME": db_name,
+        # the fake server has no limits, the buckets are still reserved on every request like in a real crawl
+        "RATE_LIMIT_MULTIPLIER": "1000000",
+        "RATE_LIMITER_DB": os.path.join(work_dir, "rate_limits.sqlite3"),
+        "RESPONSE_CACHE_DB": os.path.join(work_dir, "response_cache.sqlite3"),
+        "METRICS_LOG_INTERVAL": "0",
+    })
+
+
+@contextlib.contextmanager
+def _crawler_output(verbose):
+    # printing every app and player would measure the terminal more than the crawler
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _next_run():
+    """Returns the number of the first block of fake ids that no previous run wrote to the benchmark database."""
+    from database import cur, connection
+    cur.execute("SELECT MAX(appid) FROM game_details WHERE appid >= %s;", (_first_appid,))
+    max_appid = cur.fetchone()[0]
+    connection.commit()
+    run = 0 if max_appid is None else (max_appid - _first_appid) // _appids_per_run + 1
+    if run >= _max_runs:
+        raise ValueError("Every block of fake ids of the benchmark database was used, create it again from database_final_schema.sql")
+    return run
+
+
+def _measure(name, unit, items_function, fake_steam, verbose):
+    """Runs items_function, which returns the number of items it processed, and returns its results."""
+    from database import get_statement_count
+    stats_before = fake_steam.stats.copy()
+    statements_before = get_statement_count()
+    start = time.perf_counter()
+    with _crawler_output(verbose):
+        items = items_function()
+    seconds = time.perf_counter() - start
+    statements = get_statement_count() - statements_before - 1
+    requests = {f"{endpoint} {status}": count for (endpoint, status), count in (fake_steam.stats - stats_before).items()}
+    return {
+        "benchmark": name,
+        "unit": unit,
+        "items": items,
+        "seconds": round(seconds, 3),
+        "per_second": round(items / seconds, 2) if seconds > 0 else 0,
+        "statements_per_item": round(statements / items, 2) if items > 0 else 0,
+        "requests": requests,
+    }
+
+
+def benchmark_get_app_data(appids):
+    from crawl_app_data import get_app_data
+    for appid in appids:
+        get_app_data(str(appid), reviews=False, verbose=False)
+    return len(appids)
+
+
+def download_pages(appids):
+    from crawl_app_data import download_review_pages
+    return [(appid, page_reviews, next_cursor) for appid in appids for page_reviews, _, next_cursor in download_review_pages(appid)]
+
+
+def benchmark_process_game_reviews(pages):
+    from database import process_game_reviews
+    for appid, page_reviews, next_cursor in pages:
+        process_game_reviews(appid, page_reviews, next_cursor)
+    return sum(len(page_reviews) for _, page_reviews, _ in pages)
+
+
+def benchmark_crawl_player_data():
+    import crawl_all_player_data
+    processed_before = crawl_all_player_data.num_processed_players
+    crawl_all_player_data.crawl_player_data(verbose=False, worker_id="benchmark")
+    return crawl_all_player_data.num_processed_players - processed_before
+
+
+def compare(results, baseline):
+    baseline = {result["benchmark"]: result for result in baseline["results"]}
+    for result in results:
+        if result["benchmark"] not in baseline:
+            continue
+        old = baseline[result["benchmark"]]
+        speedup = result["per_second"] / old["per_second"] if old["per_second"] > 0 else float("inf")
+        print(f"{result['benchmark']}: {old['per_second']} -> {result['per_second']} {result['unit']}/s ({speedup:.2f}x), "
+              f"{old['statements_per_item']} -> {result['statements_per_item']} statements per item")
+
+
+def _run_selected(appids, fake_steam, only, verbose):
+    pages = []
+    benchmarks = [
+        ("get_app_data", "apps", lambda: benchmark_get_app_data(appids)),
+        ("process_game_reviews", "reviews", lambda: benchmark_process_game_reviews(pages)),
+        ("crawl_player_data", "players", benchmark_crawl_player_data),
+    ]
+    selected = [name for name, _, _ in benchmarks if only is None or name in only]
+    results = []
+    for i, (name, unit, items_function) in enumerate(benchmarks):
+        # a benchmark that isn't selected still runs, unmeasured, if the ones after it need the data it writes
+        needed_later = any(later_name in selected for later_name, _, _ in benchmarks[i + 1:])
+        if name not in selected and not needed_later:
+            continue
+        if name == "process_game_reviews":
+            with _crawler_output(verbose):
+                pages.extend(download_pages(appids))
+        if name in selected:
+            results.append(_measure(name, unit, items_function, fake_steam, verbose))
+        else:
+            with _crawler_output(verbose):
+                items_function()
+    return results
+
+
+def run_benchmarks(apps=100, players=2000, reviews_per_app=300, games_per_player=50, latency=0.05, jitter=0.02, rate_429=0.0, rate_502=0.0,
+                   recordings_dir=None, db_name="steam_tfg_jgg_bench", only=None, verbose=False):
+    """Runs the benchmarks against a fake Steam server started in this process.
+
+    Args:
+        only (list, optional): names of the benchmarks to run, every one by default
+
+    Returns:
+        list[dict]: the results of every benchmark
+    """
+    if apps > _appids_per_run or players > _steamids_per_run or apps * 1000 > _recommendationids_per_run:
+        raise ValueError(f"At most {_appids_per_run} apps and {_steamids_per_run} players per run")
+    # the ids of the run are only known once the crawler modules can read the database, which needs the address of the server
+    fake_steam = FakeSteam([], [], reviews_per_app=reviews_per_app, games_per_player=games_per_player,
+                           latency=latency, jitter=jitter, rate_429=rate_429, rate_502=rate_502, recordings_dir=recordings_dir)
+    server = fake_steam.start()
+    try:
+        work_dir = tempfile.mkdtemp(prefix="steam_crawler_benchmark_")
+        _configure_crawlers(f"http://127.0.0.1:{server.server_address[1]}", db_name, work_dir)
+        run = _next_run()
+        appids = list(range(_first_appid + run * _appids_per_run, _first_appid + run * _appids_per_run + apps))
+        # every review of an app needs a different author
+        steamids = range(_first_steamid + run * _steamids_per_run, _first_steamid + run * _steamids_per_run + max(players, reviews_per_app))
+        fake_steam.set_ids(appids, steamids, _first_recommendationid + run * _recommendationids_per_run)
+        return _run_selected(appids, fake_steam, only, verbose)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the crawlers against a local fake Steam API.")
+    parser.add_argument("-a", "--apps", type=int, default=100, help="Number of fake apps to crawl.")
+    parser.add_argument("-n", "--players", type=int, default=2000, help="Number of fake players writing reviews, the ones crawl_player_data crawls.")
+    parser.add_argument("--reviews-per-app", type=int, default=300, help="Reviews of every fake app, at most 1000.")
+    parser.add_argument("--games-per-player", type=int, default=50, help="Games owned by every fake player.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every response of the fake server takes.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random seconds added to or removed from the latency.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of responses that are 429 Too Many Requests.")
+    parser.add_argument("--rate-502", type=float, default=0.0, help="Fraction of responses that are 502 Bad Gateway.")
+    parser.add_argument("-r", "--recordings", default=None, help="Folder with the responses saved by record_responses.py.")
+    parser.add_argument("--db-name", default="steam_tfg_jgg_bench", help="Database the benchmarks write to.")
+    parser.add_argument("--only", nargs="+", choices=["get_app_data", "process_game_reviews", "crawl_player_data"], help="Only run these benchmarks.")
+    parser.add_argument("-o", "--output", default=None, help="Save the results to this JSON file, to use it as a baseline later.")
+    parser.add_argument("-b", "--baseline", default=None, help="Compare the results with the ones saved in this JSON file.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the output of the crawlers.")
+    args = parser.parse_args()
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "verbose")}
+    results = run_benchmarks(args.apps, args.players, args.reviews_per_app, args.games_per_player, args.latency, args.jitter, args.rate_429, args.rate_502,
+                             args.recordings, args.db_name, args.only, args.verbose)
+    for result in results:
+        print(f"{result['benchmark']}: {result['items']} {result['unit']} in {result['seconds']} seconds, {result['per_second']} {result['unit']}/s, "
+              f"{result['statements_per_item']} statements per {result['unit'][:-1]}")
+        print(f"    requests: {result['requests']}")
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"parameters": parameters, "results": results}, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.baseline is not None:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
@@ -0,0 +1,243 @@
+"""
+This script builds the player x game interaction matrix used for recommendations, straight from player_games.
+The matrix is stored in CSR form as raw NumPy arrays that can be memory-mapped, rows are players and columns are games,
+and the values are playtime_forever in minutes (owned but never played games are stored as explicit zeros).
+
+Files of the output directory:
+    indptr.bin (int64), indices.bin (int32), data.bin (int32): the CSR arrays
+    steamids.bin (uint64): the steamid of every row
+    appids.bin (uint32): the appid of every column
+    meta.json: the size of every array and the database time of the last build
+
+Rows are only ever appended: runs after the first add the players crawled since the previous one that aren't in the matrix yet.
+Only players whose game list was crawled (visibility >= 2) get a row, in full and incremental builds alike.
+"""
+
+import json
+import os
+import time
+import numpy as np
+from database import *
+
+_dtypes = {
+    "indptr": np.int64,
+    "indices": np.int32,
+    "data": np.int32,
+    "steamids": np.uint64,
+    "appids": np.uint32,
+}
+
+def _array_path(directory, name):
+    return os.path.join(directory, name + ".bin")
+
+def _array_lengths(meta):
+    return {
+        "indptr": meta["num_rows"] + 1,
+        "indices": meta["nnz"],
+        "data": meta["nnz"],
+        "steamids": meta["num_rows"],
+        "appids": meta["num_cols"],
+    }
+
+def load_meta(directory):
+    with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_arrays(directory, mode="r"):
+    """Memory-maps every array of a built matrix, without reading them into memory.
+
+    Returns:
+        dict: array name -> np.memmap (or an empty array if it has no elements yet)
+    """
+    meta = load_meta(directory)
+    arrays = dict()
+    for name, length in _array_lengths(meta).items():
+        if length == 0:
+            arrays[name] = np.empty(0, dtype=_dtypes[name])
+        else:
+            arrays[name] = np.memmap(_array_path(directory, name), dtype=_dtypes[name], mode=mode, shape=(length,))
+    return arrays
+
+def load_interaction_matrix(directory):
+    """Loads a built matrix as a scipy.sparse.csr_matrix backed by the memory-mapped arrays.
+
+    Returns:
+        Tuple[scipy.sparse.csr_matrix, np.ndarray, np.ndarray]: the matrix, the steamid of every row and the appid of every column
+    """
+    # scipy is only needed to use the matrix, not to build it
+    from scipy.sparse import csr_matrix
+    meta = load_meta(directory)
+    arrays = load_arrays(directory)
+    matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=(meta["num_rows"], meta["num_cols"]), copy=False)
+    return matrix, arrays["steamids"], arrays["appids"]
+
+class InteractionMatrixWriter:
+    """Appends players to the CSR arrays of a directory.
+
+    meta.json is only rewritten after the arrays, so a build that crashes halfway leaves a valid matrix behind,
+    and the leftover bytes past the sizes in meta.json are truncated when the next writer is created.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            self.meta = load_meta(directory)
+        else:
+            self.meta = {"num_rows": 0, "num_cols": 0, "nnz": 0, "since": None}
+        for name, length in _array_lengths(self.meta).items():
+            with open(_array_path(directory, name), "ab") as f:
+                f.truncate(length * np.dtype(_dtypes[name]).itemsize)
+        if self.meta["num_rows"] == 0:
+            with open(_array_path(directory, "indptr"), "wb") as f:
+                np.zeros(1, dtype=_dtypes["indptr"]).tofile(f)
+            self._save_meta()
+        arrays = load_arrays(directory)
+        # games are a few hundred thousand at most, players aren't, so only the columns get a dict
+        self._columns = {int(appid): column for column, appid in enumerate(arrays["appids"])}
+        self._sorted_steamids = np.sort(arrays["steamids"])
+
+    def contains(self, steamids) -> np.ndarray:
+        """Returns a boolean mask of which steamids had a row when the writer was created."""
+        steamids = np.asarray(steamids, dtype=_dtypes["steamids"])
+        if len(self._sorted_steamids) == 0:
+            return np.zeros(len(steamids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self._sorted_steamids, steamids), len(self._sorted_steamids) - 1)
+        return self._sorted_steamids[positions] == steamids
+
+    def append(self, players):
+        """Appends one row per player.
+
+        Args:
+            players (list[Tuple[int, list[Tuple[int, int]]]]): (steamid, [(appid, playtime_forever), ...]) for every player
+        """
+        if len(players) == 0:
+            return
+        new_appids = []
+        indptr = np.empty(len(players), dtype=_dtypes["indptr"])
+        indices = []
+        data = []
+        nnz = self.meta["nnz"]
+        for row, (steamid, games) in enumerate(players):
+            columns = []
+            for appid, playtime_forever in games:
+                column = self._columns.get(appid)
+                if column is None:
+                    column = len(self._columns)
+                    self._columns[appid] = column
+                    new_appids.append(appid)
+                columns.append(column)
+            # CSR expects the column indices of every row sorted
+            order = np.argsort(columns, kind="stable")
+            indices.append(np.asarray(columns, dtype=_dtypes["indices"])[order])
+            data.append(np.asarray([playtime for _, playtime in games], dtype=_dtypes["data"])[order])
+            nnz += len(games)
+            indptr[row] = nnz
+        self._append_array("indices", np.concatenate(indices))
+        self._append_array("data", np.concatenate(data))
+        self._append_array("indptr", indptr)
+        self._append_array("steamids", np.asarray([steamid for steamid, _ in players], dtype=_dtypes["steamids"]))
+        self._append_array("appids", np.asarray(new_appids, dtype=_dtypes["appids"]))
+        self.meta["num_rows"] += len(players)
+        self.meta["num_cols"] = len(self._columns)
+        self.meta["nnz"] = nnz
+        self._save_meta()
+
+    def set_since(self, since: str):
+        self.meta["since"] = since
+        self._save_meta()
+
+    def _append_array(self, name, array):
+        with open(_array_path(self.directory, name), "ab") as f:
+            array.tofile(f)
+
+    def _save_meta(self):
+        path = os.path.join(self.directory, "meta.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+def _group_by_player(rows):
+    players = []
+    for steamid, appid, playtime_forever, *_ in rows:
+        if len(players) == 0 or players[-1][0] != steamid:
+            players.append((steamid, []))
+        players[-1][1].append((appid, playtime_forever))
+    return players
+
+def _build_full(writer, chunk_size, verbose):
+    # review authors that weren't crawled yet are left out, the incremental builds add them with their whole library once they are
+    after_steamid, after_appid = 0, 0
+    pending = []
+    rows = export_crawled_player_games(after_steamid, after_appid, chunk_size)
+    while len(rows) > 0:
+        after_steamid, after_appid = rows[-1][0], rows[-1][1]
+        players = _group_by_player(pending + rows)
+        # the last player of a chunk might continue in the next one
+        pending = [(steamid, appid, playtime) for steamid, games in players[-1:] for appid, playtime in games]
+        writer.append(players[:-1])
+        if verbose:
+            print(f"{writer.meta['num_rows']} players, {writer.meta['num_cols']} games, {writer.meta['nnz']} interactions")
+        rows = export_crawled_player_games(after_steamid, after_appid, chunk_size)
+    writer.append(_group_by_player(pending))
+
+def _build_incremental(writer, since, chunk_size, verbose):
+    after_steamid = 0
+    steamids = get_players_retrieved_since(since, after_steamid, chunk_size)
+    while len(steamids) > 0:
+        after_steamid = steamids[-1]
+        # refreshed players already have a row, they keep the games they had on the previous build
+        new_steamids = [steamid for steamid, exists in zip(steamids, writer.contains(steamids)) if not exists]
+        player_games = get_player_games(new_steamids)
+        players = [(steamid, [(appid, values[0]) for appid, values in sorted(player_games[str(steamid)].items())])
+                   for steamid in new_steamids]
+        writer.append([player for player in players if len(player[1]) > 0])
+        if verbose:
+            print(f"{writer.meta['num_rows']} players, {writer.meta['num_cols']} games, {writer.meta['nnz']} interactions")
+        steamids = get_players_retrieved_since(since, after_steamid, chunk_size)
+
+def build_interaction_matrix(directory, full=False, chunk_size=100000, verbose=False):
+    """Builds the matrix into `directory`, or appends the players crawled since the previous build if there's one.
+
+    Args:
+        full (bool): delete the matrix of the directory and build it again from the player_games of every crawled player
+        chunk_size (int): rows of player_games per query in full builds, players per query in incremental ones
+    """
+    if not full and os.path.exists(os.path.join(directory, "meta.json")) and load_meta(directory)["since"] is None:
+        # a full build was interrupted, appending to it would repeat the players it already wrote
+        print("The previous build didn't finish, building from scratch...")
+        full = True
+    if full:
+        for name in list(_dtypes) + ["meta"]:
+            path = os.path.join(directory, "meta.json") if name == "meta" else _array_path(directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+    writer = InteractionMatrixWriter(directory)
+    build_time = get_database_time().strftime("%Y-%m-%d %H:%M:%S")
+    if writer.meta["since"] is None:
+        print("Building the interaction matrix from every player...")
+        _build_full(writer, chunk_size, verbose)
+    else:
+        print(f"Appending players crawled since {writer.meta['since']}...")
+        # every player brings dozens to hundreds of games, so chunks of players are smaller
+        _build_incremental(writer, writer.meta["since"], max(chunk_size // 100, 1), verbose)
+    writer.set_since(build_time)
+    print(f"{writer.meta['num_rows']} players, {writer.meta['num_cols']} games, {writer.meta['nnz']} interactions")
+    return writer.meta
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Build the player x game interaction matrix from player_games.")
+    parser.add_argument("output_dir", help="Directory of the matrix.")
+    parser.add_argument("--full", action="store_true", help="Build the matrix again from scratch instead of appending new players.")
+    parser.add_argument("-c", "--chunk_size", type=int, default=100000, help="Rows read per query.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    try:
+        start_time = time.time()
+        build_interaction_matrix(args.output_dir, args.full, args.chunk_size, args.verbose)
+        print("Done!")
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected. Exiting...")
+    finally:
+        print("Total time:", time.time() - start_time, "seconds")
@@ -1,10 +1,18 @@
 
-from steam import Steam  # https://pypi.org/project/python-steam-api/
-from decouple import config, UndefinedValueError
+from decouple import config, UndefinedValueError, Csv
+import os
 import time
-from collections import deque
+import asyncio
+import metrics
+from rate_limiter import RateLimiter
+from key_pool import KeyPool, get_key_id
+from response_cache import ResponseCache
 try:
-    KEY = config("STEAM_API_KEY")
+    # several keys can be given as STEAM_API_KEYS="KEY1,KEY2,...", STEAM_API_KEY is used otherwise
+    KEYS = config("STEAM_API_KEYS", default="", cast=Csv())
+    KEY = KEYS[0] if len(KEYS) > 0 else config("STEAM_API_KEY")
+    if len(KEYS) == 0:
+        KEYS = [KEY]
 except UnicodeDecodeError as e:
     print("Ensure your .env/settings.ini file is encoded in UTF-8.")
     exit(-1)
@@ -12,10 +20,9 @@ except UndefinedValueError as e:
     print(e)
     print("Tips:\r\n- You can create an .env file with 'STEAM_API_KEY=\"YOUR_API_KEY\"'.")
     print("- You can also define an environment variable STEAM_API_KEY with your API key.")
+    print("- To use more than one key, use STEAM_API_KEYS=\"KEY1,KEY2\" instead.")
     exit(-1)
 
-steam = Steam(KEY)
-
 # Used for steamreviews
 # Reference: https://partner.steamgames.com/doc/store/getreviews
 # note: it would be interesting to use the "last update" date of the game, but
@@ -40,29 +47,69 @@ _rate_limits = {
 def get_steam_api_rate_limits():
     return _rate_limits
 
-max_num_queries = _rate_limits["max_num_queries"]
-cooldown = _rate_limits["cooldown"]
-timestamp_queue = deque(maxlen=max_num_queries + 1)
+# Budgets for our own calls, per endpoint. The bucket refills completely every "cooldown" seconds,
+# so a crawler that was idle can use the whole bucket at once instead of waiting for the next minute
+_endpoint_rate_limits = {
+    "appdetails": {"max_num_queries": 200, "cooldown": 300, "daily_quota": False},  # the store allows ~200 requests every 5 minutes
+    "appreviews": {"max_num_queries": 45, "cooldown": 60, "daily_quota": False},
+    "GetOwnedGames": {"max_num_queries": 60, "cooldown": 60, "daily_quota": True},
+    "GetPlayerSummaries": {"max_num_queries": 10, "cooldown": 60, "daily_quota": True},
+    "GetAppList": {"max_num_queries": 10, "cooldown": 60, "daily_quota": True},
+}
+# Web API calls (the ones with "daily_quota") share the 100.000 queries per day of their API key
+daily_quota = config("STEAM_API_DAILY_QUOTA", default=100000, cast=int)
+
+# RATE_LIMIT_MULTIPLIER scales every budget. Only meant for servers that aren't Steam, like the fake one of the benchmarks
+rate_limit_multiplier = config("RATE_LIMIT_MULTIPLIER", default=1.0, cast=float)
+if rate_limit_multiplier != 1.0:
+    _rate_limits["max_num_queries"] = int(_rate_limits["max_num_queries"] * rate_limit_multiplier)
+    for limits in _endpoint_rate_limits.values():
+        limits["max_num_queries"] = int(limits["max_num_queries"] * rate_limit_multiplier)
+    daily_quota = int(daily_quota * rate_limit_multiplier)
+
+# every crawler on the same machine shares this file, so they don't get each other rate limited
+rate_limiter = RateLimiter(config("RATE_LIMITER_DB", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "rate_limits.sqlite3")),
+                           _endpoint_rate_limits, daily_quota)
+
+def check_rate_limit(count, endpoint):
+    count, wait_time = rate_limiter.reserve(endpoint)
+    while wait_time > 0:
+        print(f"Waiting {wait_time} seconds to avoid {endpoint} rate limit...")
+        metrics.inc("rate_limit_wait_seconds_total", wait_time, endpoint=endpoint)
+        time.sleep(wait_time)
+        count, wait_time = rate_limiter.reserve(endpoint)
+    return count
+
+async def async_check_rate_limit(count, endpoint):
+    # reserve is a blocking SQLite transaction, it runs in a thread so it doesn't freeze the other coroutines
+    count, wait_time = await asyncio.to_thread(rate_limiter.reserve, endpoint)
+    while wait_time > 0:
+        print(f"Waiting {wait_time} seconds to avoid {endpoint} rate limit...")
+        metrics.inc("rate_limit_wait_seconds_total", wait_time, endpoint=endpoint)
+        await asyncio.sleep(wait_time)
+        count, wait_time = await asyncio.to_thread(rate_limiter.reserve, endpoint)
+    return count
+
+# Web API calls take their key from the pool, which spreads them over every healthy key
+key_pool = KeyPool(KEYS, rate_limiter)
+# rate limits files written before the key pool counted the quota of KEY without a key id
+rate_limiter.import_legacy_daily_usage(get_key_id(KEY))
+
+def get_api_key(endpoint):
+    return key_pool.get_key(endpoint)
 
-def check_rate_limit(count):
-    timestamp_queue.appendleft(time.time())
-    count = len(timestamp_queue)
+async def async_get_api_key(endpoint):
+    return await key_pool.async_get_key(endpoint)
 
-    if count > max_num_queries:
-        # pop every timestamp that is older than 60 seconds
-        popped_time = timestamp_queue.pop()
-        elapsed_time = time.time() - popped_time
-        while elapsed_time > cooldown:
-            popped_time = timestamp_queue.pop()
-            elapsed_time = time.time() - popped_time
+def report_api_key_status(key, status_code):
+    key_pool.report(key, status_code)
 
-        count = len(timestamp_queue)
-        if count >= max_num_queries:
-            # now empty the query and get the first timestamp
-            popped_time = timestamp_queue.pop()
+# appdetails and review summaries are cached on disk, so restarting a crawler doesn't spend the rate limit on them again
+response_cache = ResponseCache(config("RESPONSE_CACHE_DB", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "response_cache.sqlite3")),
+                               ttl=config("RESPONSE_CACHE_TTL", default=24 * 60 * 60, cast=int),
+                               max_bytes=config("RESPONSE_CACHE_MAX_BYTES", default=512 * 1024 * 1024, cast=int))
 
-            wait_time = cooldown - (time.time() - popped_time)
-            print(f"Waiting {wait_time} seconds to avoid rate limit...")
-            time.sleep(wait_time)
-            count -= 1
-    return count
\ No newline at end of file
+# METRICS_PORT serves the metrics of a crawler on http://127.0.0.1:<port>/metrics (0 disables it), workers use the next ports.
+# Every METRICS_LOG_INTERVAL seconds the metrics are also printed as a JSON line (0 disables it)
+metrics_port = config("METRICS_PORT", default=0, cast=int)
+metrics_log_interval = config("METRICS_LOG_INTERVAL", default=60, cast=int)
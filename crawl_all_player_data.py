@@ -4,39 +4,136 @@ Author: Jorge González
 Date: 2023-02-20
 """
 
+import asyncio
 import json
+import metrics
+import multiprocessing
 import time
-import requests
+import transport
 import steamreviews
 from database import *
 import os
 from crawl_app_data import get_app_data, ERROR, SUCCESS, ALREADY_EXISTS, FULLY_PROCESSED, SKIPPED, FAULTY
-from config import steam, check_rate_limit, KEY
+from config import get_api_key, async_get_api_key, report_api_key_status, metrics_port, metrics_log_interval
 
 num_processed_players = 0
 
-def crawl_player_data(query_count=0, reviews=False, only_games=True, verbose=False):
-    global num_processed_players
-    unprocessed_players = get_100_unprocessed_players()
+# a batch with many new games can take longer than its lease, so the lease is extended while the batch is still being crawled
+lease_seconds = 1800
+_lease_extend_interval = lease_seconds / 3
+_lease_extended_at = 0
+
+def extend_lease_if_needed(worker_id):
+    global _lease_extended_at
+    if time.time() - _lease_extended_at > _lease_extend_interval:
+        extend_player_lease(worker_id, lease_seconds)
+        _lease_extended_at = time.time()
+
+async def _fetch_owned_games(steamid):
+    while True:
+        try:
+            key = await async_get_api_key("GetOwnedGames")
+            # requests is blocking, so every fetch runs in the default executor and the event loop only waits on them
+            resp = await asyncio.to_thread(
+                transport.get,
+                transport.API_URL + "/IPlayerService/GetOwnedGames/v1/",
+                params={"steamid": steamid,
+                        "include_appinfo": False,
+                        "include_played_free_games": True,
+                        "key": key},
+            )
+            report_api_key_status(key, resp.status_code)
+            if resp.status_code == 200: # I didn't trust the API to return stuff properly when rate limited
+                return json.loads(resp.text)["response"]
+            else:
+                print(f"Error while requesting owned games for {steamid}. Waiting 3 seconds: ")
+                print(resp.text)
+                await asyncio.sleep(3)
+        except Exception as e:
+            print(f"Exception while requesting owned games for {steamid}. Waiting 10 seconds: ")
+            print(e)
+            await asyncio.sleep(10)
+
+async def _fetch_owned_games_batch(steamids):
+    owned_games = await asyncio.gather(*(_fetch_owned_games(steamid) for steamid in steamids))
+    return dict(zip(steamids, owned_games))
+
+def fetch_owned_games_batch(steamids):
+    """Fetches IPlayerService/GetOwnedGames for every steamid at once, within the rate limit.
+
+    Args:
+        steamids (list[str]): the steamids of the players with a public profile
+
+    Returns:
+        dict: steamid -> the "response" object of GetOwnedGames
+    """
+    if len(steamids) == 0:
+        return dict()
+    return asyncio.run(_fetch_owned_games_batch(steamids))
+
+def resolve_owned_game(appid, query_count=0, reviews=False, only_games=True, verbose=False):
+    """Makes sure an owned game is in game_details before a player_games row references it, crawling it if needed.
+
+    Returns:
+        Tuple[int, int]: the get_app_data status (SKIPPED means the row shouldn't be written) and the updated query count
+    """
+    if game_exists(appid):
+        return ALREADY_EXISTS, query_count
+    if verbose:
+        print(f"{appid} doesn't exist in database, crawling...")
+    success, query_count = get_app_data(str(appid), reviews=reviews, query_count=query_count, only_games=only_games, verbose=verbose)
+    if success == ERROR:
+        if verbose:
+            print("Error while crawling game, adding as 'DEAD_HIDDEN_GAME' with no info...")
+        # NOTE: this is specially useful to see 'if you used to play appid X and you now play appid Y, others might like appid Y'
+        # for example: Project Cars 1 and 2 are dead, but you might like Project Cars 3 without genre context
+        # also PUBG Test Server, Realm Royale Public Test, etc. are hidden
+        add_dead_hidden_game(appid)
+    elif success == SKIPPED:
+        if verbose:
+            print("Non-game/mod skipped, skipping...")
+    elif success == FAULTY:
+        if verbose:
+            print("Faulty game, inserting as faulty with 'FAULTY_GAME' with no info...")
+        add_faulty_game(appid)
+    return success, query_count
+
+def crawl_player_data(query_count=0, reviews=False, only_games=True, verbose=False, worker_id=default_worker_id):
+    global num_processed_players, _lease_extended_at
+    crawl_start_time = time.time()
+    unprocessed_players = claim_unprocessed_players(worker_id, lease_seconds=lease_seconds)
     while len(unprocessed_players) > 0:
         start_time = time.time()
+        _lease_extended_at = start_time
         steam_ids = [str(player[0]) for player in unprocessed_players]
         while True:
             try:
-                query_count = check_rate_limit(query_count)
-                response = steam.users.get_user_details(",".join(steam_ids), single=False)
-                if "players" in response:
-                    break
-                else:
-                    print("Error while requesting user details, no players. Waiting 10 seconds: ")
-                    print(response)
-                    time.sleep(10)
+                key = get_api_key("GetPlayerSummaries")
+                resp = transport.get(
+                    transport.API_URL + "/ISteamUser/GetPlayerSummaries/v2/",
+                    params={"steamids": ",".join(steam_ids),
+                            "key": key},
+                )
+                report_api_key_status(key, resp.status_code)
+                if resp.status_code == 200:
+                    response = json.loads(resp.text)["response"]
+                    if "players" in response:
+                        break
+                print("Error while requesting user details, no players. Waiting 10 seconds: ")
+                print(resp.text)
+                time.sleep(10)
             except Exception as e:
                 print("Exception while requesting user details. Waiting 10 seconds: ")
                 print(e)
                 time.sleep(10)
         players = response["players"]
+        # all the owned games requests of the batch are made concurrently, the DB writes below stay sequential
+        public_steamids = [player["steamid"] for player in players if player["communityvisibilitystate"] >= 3]
+        owned_games_by_steamid = fetch_owned_games_batch(public_steamids)
+        stored_games_by_steamid = get_player_games(public_steamids)
+        num_unchanged_games = 0
         for player in players:
+            extend_lease_if_needed(worker_id)
             steamid = player["steamid"]
             cvs = player["communityvisibilitystate"]
             num_processed_players += 1
@@ -54,29 +151,7 @@ def crawl_player_data(query_count=0, reviews=False, only_games=True, verbose=Fal
             loccountrycode = player["loccountrycode"] if "loccountrycode" in player else None
             locstatecode = player["locstatecode"] if "locstatecode" in player else None
             loccityid = player["loccityid"] if "loccityid" in player else None
-            while True:
-                try:
-                    query_count = check_rate_limit(query_count)
-                    resp = requests.request(
-                        "get",
-                        "https://api.steampowered.com/IPlayerService/GetOwnedGames/v1/",
-                        params={"steamid": steamid,
-                                "include_appinfo": False,
-                                "include_played_free_games": True,
-                                "key": KEY},
-                    )
-                    if resp.status_code == 200: # I didn't trust the API to return stuff properly when rate limited
-                        owned_games = json.loads(resp.text)["response"]
-                        break
-                    else:
-                        print("Error while requesting owned games. Waiting 3 seconds: ")
-                        print(resp.text)
-                        time.sleep(3)
-                except Exception as e:
-                    print("Exception while requesting user details. Waiting 10 seconds: ")
-                    print(e)
-                    time.sleep(10)
-            
+            owned_games = owned_games_by_steamid[steamid]
             if "games" not in owned_games:
                 if verbose:
                     print("Game list is private, skipping...")
@@ -90,32 +165,27 @@ def crawl_player_data(query_count=0, reviews=False, only_games=True, verbose=Fal
                 continue
             
             visible_playtime = False
+            # players being refreshed already have games stored, only the added ones and the ones with new playtimes get written
+            player_stored_games = stored_games_by_steamid[steamid]
             for game in owned_games["games"]:
                 appid = game["appid"]
-                success = game_exists(appid)
-
-                if not success:
-                    if verbose:
-                        print(f"{appid} doesn't exist in database, crawling...")
-                    success, query_count = get_app_data(str(appid), reviews=reviews, query_count=query_count, only_games=only_games, verbose=verbose)
                 visible_playtime |= game["playtime_forever"] > 0
-                if success == ERROR:
-                    if verbose:
-                        print("Error while crawling game, adding as 'DEAD_HIDDEN_GAME' with no info...")
-                    # NOTE: this is specially useful to see 'if you used to play appid X and you now play appid Y, others might like appid Y'
-                    # for example: Project Cars 1 and 2 are dead, but you might like Project Cars 3 without genre context
-                    # also PUBG Test Server, Realm Royale Public Test, etc. are hidden
-                    add_dead_hidden_game(appid)
-                elif success == SKIPPED:
-                    if verbose:
-                        print("Non-game/mod skipped, skipping...")
+                # same clamping as internal_insert_player_games, so unchanged rows compare equal to the stored ones
+                game_row = (game["playtime_forever"], game["playtime_windows_forever"], game["playtime_mac_forever"], game["playtime_linux_forever"], max(game["rtime_last_played"], 1))
+                stored_row = player_stored_games.get(appid)
+                if stored_row == game_row:
+                    num_unchanged_games += 1
                     continue
-                elif success == FAULTY:
-                    if verbose:
-                        print("Faulty game, inserting as faulty with 'FAULTY_GAME' with no info...")
-                    add_faulty_game(appid)
-                # insert_player_game_data(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played)
-                insert_player_game_data(steamid, appid, game["playtime_forever"], game["playtime_windows_forever"], game["playtime_mac_forever"], game["playtime_linux_forever"], game["rtime_last_played"])
+                if stored_row is None:
+                    extend_lease_if_needed(worker_id)
+                    success, query_count = resolve_owned_game(appid, query_count, reviews=reviews, only_games=only_games, verbose=verbose)
+                    if success == SKIPPED:
+                        continue
+                # buffer_player_game_data(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played)
+                buffer_player_game_data(steamid, appid, *game_row, new_game=stored_row is None)
+
+            # the games have to be written before the player gets a visibility, otherwise a crash would leave them marked as crawled without games
+            flush_player_game_data()
 
             process_steam_user(steamid, player["personaname"], 2 if not visible_playtime else 3, owned_games["game_count"],
                                commentpermission=commentpermission, 
@@ -126,14 +196,59 @@ def crawl_player_data(query_count=0, reviews=False, only_games=True, verbose=Fal
                                loccityid=loccityid)
         ply_number = len(players)
         steamid_num = len(steam_ids)
-        print(f"Processed {ply_number}/{steamid_num} players ({steam_ids}), Time to process batch:", time.time() - start_time, "seconds")
+        players_per_second = num_processed_players / (time.time() - crawl_start_time)
+        metrics.inc("players_processed_total", ply_number, worker=worker_id)
+        metrics.inc("player_games_unchanged_total", num_unchanged_games, worker=worker_id)
+        metrics.set_gauge("player_batch_size", ply_number, worker=worker_id)
+        metrics.set_gauge("players_per_second", players_per_second, worker=worker_id)
+        metrics.observe("player_batch_seconds", time.time() - start_time, worker=worker_id)
+        print(f"[{worker_id}] Processed {ply_number}/{steamid_num} players ({steam_ids}), Time to process batch:", time.time() - start_time, "seconds")
+        print(f"[{worker_id}] {num_processed_players} players processed, {players_per_second:.2f} players/s, {num_unchanged_games} unchanged games skipped in this batch")
+        # candidate counts of the whole batch go in one upsert, popular games would get bumped once per owner otherwise
+        flush_candidate_games()
+        report_worker(worker_id, num_processed_players, players_per_second)
         if ply_number != steamid_num:
             faulty_players = [steamid for steamid in steam_ids if steamid not in [player["steamid"] for player in players]]
             print("Faulty player(s) detected, please check manually: ", faulty_players)
-        unprocessed_players = get_100_unprocessed_players()
+            # they keep visibility NULL, enqueue_unprocessed_players would add them back
+            remove_players_from_queue(faulty_players)
+        metrics.set_gauge("player_crawl_queue_depth", get_queue_depth())
+        unprocessed_players = claim_unprocessed_players(worker_id, lease_seconds=lease_seconds)
     
     return query_count
 
+def run_worker(reviews=False, only_games=True, worker_number=0):
+    # every worker is a different process, so default_worker_id is already unique per worker
+    # and so are the metrics, each worker serves them on its own port
+    metrics.start(metrics_port + worker_number if metrics_port > 0 else 0, metrics_log_interval, default_worker_id)
+    start_time = time.time()
+    try:
+        crawl_player_data(query_count=0, reviews=reviews, only_games=only_games)
+        print(f"[{default_worker_id}] Done!")
+    except KeyboardInterrupt:
+        print(f"[{default_worker_id}] KeyboardInterrupt detected. Exiting...")
+    finally:
+        print(f"[{default_worker_id}] Total players processed:", num_processed_players)
+        print(f"[{default_worker_id}] Total time:", time.time() - start_time, "seconds")
+
+def run_workers(num_workers, reviews=False, only_games=True):
+    """Crawls players with several processes at once, coordinated through player_crawl_queue.
+
+    More hosts can run their own workers against the same database (see DB_HOST in database_internal.py).
+    """
+    # spawn instead of fork, a forked worker would share the parent's MySQL connection
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(reviews, only_games, worker_number + 1)) for worker_number in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # the workers got the same KeyboardInterrupt, wait for them to finish their cleanup
+        for worker in workers:
+            worker.join()
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Crawl player data from the database.")
@@ -141,8 +256,24 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--reviews", action="store_true", help="Crawl reviews for every game in the database.")
     # another one for only games
     parser.add_argument("-g", "--only_games", action="store_false", help="Only crawl games, not DLCs or other types of products.")
+    parser.add_argument("--fill-queue", action="store_true", help="Add every player without a visibility to the crawl queue before crawling.")
+    parser.add_argument("--refresh-days", type=int, default=None, help="Add the players crawled more than this many days ago to the crawl queue, to refresh their owned games.")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Number of worker processes crawling at the same time.")
     args = parser.parse_args()
+    if args.fill_queue:
+        print("Filling the player crawl queue...")
+        print(f"{enqueue_unprocessed_players()} players added to the queue.")
+    if args.refresh_days is not None:
+        print(f"Queueing players crawled more than {args.refresh_days} days ago...")
+        print(f"{enqueue_stale_players(args.refresh_days)} players added to the queue.")
     print(f"Crawling player data with reviews={args.reviews} and only_games={args.only_games}...")
+    if args.workers > 1:
+        print(f"Starting {args.workers} workers...")
+        start_time = time.time()
+        run_workers(args.workers, reviews=args.reviews, only_games=args.only_games)
+        print("Total time:", time.time() - start_time, "seconds")
+        exit(0)
+    metrics.start(metrics_port, metrics_log_interval, default_worker_id)
     try:
         start_time = time.time()
         crawl_player_data(query_count=0, reviews=args.reviews, only_games=args.only_games)
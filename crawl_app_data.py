@@ -4,15 +4,19 @@ Author: Jorge González
 Date: 2023-02-10
 """
 
-from typing import Tuple
-from requests import request, Response, exceptions
+from typing import Iterator, Tuple
+from requests import exceptions
+from urllib.parse import urlencode
 
 import json
+import metrics
 import time
 import steamreviews
+import transport
 from database import *
 import os
-from config import get_steam_api_rate_limits, check_rate_limit, request_params
+from exceptions import ReviewsUnavailable
+from config import get_steam_api_rate_limits, check_rate_limit, request_params, response_cache, metrics_port, metrics_log_interval
 
 
 # monkey patching to stop steamreviews from trying to open the reviews file or saving to them
@@ -31,6 +35,8 @@ def load_review_dict(app_id):
     return review_dict
 steamreviews.download_reviews.load_review_dict = load_review_dict
 steamreviews.download_reviews.get_steam_api_rate_limits = get_steam_api_rate_limits
+# steamreviews calls requests.get, this makes it use the shared session, timeouts and retries instead
+steamreviews.download_reviews.requests = transport
 
 SKIPPED = 4
 FAULTY = 3
@@ -39,9 +45,128 @@ ALREADY_EXISTS = 1
 SUCCESS = 0
 ERROR = -1
 
-def get_app_data(app_id: str, reviews=False, query_count=0, only_games=True, verbose=True) -> Tuple[int, int]:
-    retry = True
+def download_review_pages(app_id, start_cursor="*", verbose=False) -> Iterator[Tuple[dict, dict, str]]:
+    """Downloads the reviews of an app one page (100 reviews) at a time.
+
+    Args:
+        app_id (str | int): the app id of the game
+        start_cursor (str, optional): the cursor of the first page to download. Defaults to "*", the first page.
+
+    Yields:
+        Tuple[dict, dict, str]: the reviews of the page (recommendationid -> review), the query summary and the cursor of the next page
+
+    Raises:
+        ReviewsUnavailable: Steam didn't return the page of a cursor, the pages before it were yielded already
+    """
+    cursor = start_cursor
     consecutive_retries = 0
+    while True:
+        params = dict(request_params)
+        params["cursor"] = cursor
+        params["json"] = "1"
+        try:
+            check_rate_limit(0, "appreviews")
+            response = transport.get(transport.STORE_URL + "/appreviews/" + str(app_id), params=params)
+        except Exception as e:
+            print("Exception while requesting appreviews: " + str(e) + "\n")
+            consecutive_retries = min(consecutive_retries + 1, 3 * 5)
+            print(f"Waiting {(consecutive_retries * 20.0 / 60.0)} minute(s) before retrying...")
+            time.sleep(consecutive_retries * 20.0)
+            continue
+        if response.status_code != 200:
+            print(f"REST API error ({response.status_code}) while requesting reviews for {app_id}: " + str(response.text))
+            consecutive_retries = min(consecutive_retries + 1, 3)
+            print(f"Waiting {((30.0 + consecutive_retries * 30.0) / 60.0)} minute(s) before retrying...")
+            time.sleep(30.0 + consecutive_retries * 30.0)
+            continue
+        consecutive_retries = 0
+
+        result = json.loads(response.text)
+        if result.get("success") != 1:
+            raise ReviewsUnavailable(app_id, cursor, f"Steam didn't return reviews for app ID {app_id} and cursor {cursor}")
+        page_reviews = {review["recommendationid"]: review for review in result.get("reviews", [])}
+        next_cursor = result.get("cursor", cursor)
+        if verbose:
+            print(f"Cursor: {cursor}, {len(page_reviews)} reviews")
+        yield page_reviews, result.get("query_summary", dict()), next_cursor
+        if len(page_reviews) == 0 or next_cursor == cursor:
+            return
+        cursor = next_cursor
+
+def fetch_appdetails(app_id: str, query_count=0) -> Tuple[str, int]:
+    """Gets the appdetails response of an app, from the response cache if it's there.
+
+    Returns:
+        Tuple[str, int]: the text of the response, empty for faulty apps, and the updated query count
+    """
+    appdetails_params = {"appids": app_id, "cc": "us", "l": "english"}
+    # apps fetched by a run that crashed are still in the cache, and don't cost rate limit budget again
+    appdetails_cache_key = "appdetails:" + urlencode(appdetails_params)
+    appdetails_text = response_cache.get(appdetails_cache_key)
+    if appdetails_text is not None:
+        return appdetails_text, query_count
+    consecutive_retries = 0
+    retry = True
+    while retry:
+        try:
+            query_count = check_rate_limit(query_count, "appdetails")
+            response = transport.get(transport.STORE_URL + "/api/appdetails", params=appdetails_params)
+        except Exception as e:
+            print("Exception while requesting appdetails: " + str(e) + "\n")
+            consecutive_retries += 1
+            if consecutive_retries > 3 * 5: # maximum waiting time for the connection to be back: 5 minutes
+                # this high number also ensures the user may fix the problem without having to restart the script
+                consecutive_retries = 3 * 5
+            
+            print(f"Waiting {(consecutive_retries * 20.0 / 60.0)} minute(s) before retrying...")
+            time.sleep(consecutive_retries * 20.0)
+            continue
+
+        retry = response.status_code != 200
+        if retry:
+            print(f"REST API error ({response.status_code}): " + str(response.text))
+            print("Headers: " + str(response.headers) + "\n")
+            consecutive_retries += 1
+            if consecutive_retries > 3: # maximum waiting time for the API to respond again: 2 minutes
+                # this high number also ensures the user may fix the problem without having to restart the script
+                consecutive_retries = 3
+
+            print(f"Waiting {((30.0 + consecutive_retries * 30.0) / 60.0)} minute(s) before retrying...")
+            time.sleep(30.0 + consecutive_retries * 30.0)
+        else:
+            appdetails_text = response.text
+    # only successful responses are cached, errors might be temporary
+    if len(appdetails_text) > 0 and json.loads(appdetails_text)[app_id]["success"]:
+        response_cache.put(appdetails_cache_key, appdetails_text)
+    return appdetails_text, query_count
+
+def fetch_query_summary(app_id: str, query_count=0, verbose=False) -> Tuple[dict, int]:
+    """Gets the review summary of an app (total_reviews, total_positive...), from the response cache if it's there."""
+    summary_cache_key = "summary:" + app_id + ":" + urlencode(sorted(request_params.items()))
+    cached_summary = response_cache.get(summary_cache_key)
+    if cached_summary is not None:
+        return json.loads(cached_summary), query_count
+    success_flag = False
+    while success_flag == False:
+        if verbose:
+            print("Getting review summary for " + app_id)
+        try:
+            # the shared appreviews bucket limits summaries like every other page of reviews, so steamreviews gets 0
+            # and its own query counter, which knows nothing about the other crawlers, never makes it sleep
+            check_rate_limit(0, "appreviews")
+            success_flag, query_summary, _ = steamreviews.download_reviews.download_the_full_query_summary(app_id, 0, request_params)
+            if success_flag:
+                response_cache.put(summary_cache_key, json.dumps(query_summary))
+            else:
+                print("Sleeping 10 seconds")
+                time.sleep(10)
+        except exceptions.ConnectionError as e:
+            print("Error " + e)
+            print("Sleeping 10 seconds")
+            time.sleep(10)
+    return query_summary, query_count
+
+def get_app_data(app_id: str, reviews=False, query_count=0, only_games=True, verbose=True) -> Tuple[int, int]:
     game_data = get_game_data(app_id)
     exists = game_data is not None
     if (is_processed(app_id)):
@@ -52,39 +177,13 @@ def get_app_data(app_id: str, reviews=False, query_count=0, only_games=True, ver
         return ALREADY_EXISTS, query_count
     
     if not exists:
-        while retry and not exists:
-            try:
-                query_count = check_rate_limit(query_count)
-                response = request("GET", "https://store.steampowered.com/api/appdetails", params={"appids": app_id, "cc": "us", "l": "english"})
-            except Exception as e:
-                print("Exception while requesting appdetails: " + str(e) + "\n")
-                consecutive_retries += 1
-                if consecutive_retries > 3 * 5: # maximum waiting time for the connection to be back: 5 minutes
-                    # this high number also ensures the user may fix the problem without having to restart the script
-                    consecutive_retries = 3 * 5
-                
-                print(f"Waiting {(consecutive_retries * 20.0 / 60.0)} minute(s) before retrying...")
-                time.sleep(consecutive_retries * 20.0)
-                continue
-
-            retry = response.status_code != 200
-            if retry:
-                print(f"REST API error ({response.status_code}): " + str(response.text))
-                print("Headers: " + str(response.headers) + "\n")
-                consecutive_retries += 1
-                if consecutive_retries > 3: # maximum waiting time for the API to respond again: 2 minutes
-                    # this high number also ensures the user may fix the problem without having to restart the script
-                    consecutive_retries = 3
-
-                print(f"Waiting {((30.0 + consecutive_retries * 30.0) / 60.0)} minute(s) before retrying...")
-                time.sleep(30.0 + consecutive_retries * 30.0)
-                
-        if len(response.text) == 0:
+        appdetails_text, query_count = fetch_appdetails(app_id, query_count)
+        if len(appdetails_text) == 0:
             # example: https://store.steampowered.com/api/appdetails?appids=2124470
             # it exists in SteamDB and the store, but the API returns an empty response
             print(f"Empty response for faulty app ID {app_id}")
             return FAULTY, query_count
-        appdata = json.loads(response.text)
+        appdata = json.loads(appdetails_text)
         
         if appdata[app_id]["success"]:
             # First, check if this is a game
@@ -97,41 +196,40 @@ def get_app_data(app_id: str, reviews=False, query_count=0, only_games=True, ver
                 return SKIPPED, query_count
             else: name = appdata[app_id]["data"]["name"]
         else:
-            print(f"Error for app ID {app_id}: " + response.text)
+            print(f"Error for app ID {app_id}: " + appdetails_text)
             return ERROR, query_count
     else:
         name = game_data[1]
     # Then, check if this game has reviews
     if reviews:
+        # a crawl that was interrupted resumes from the last page that got committed
+        start_cursor = get_review_cursor(app_id) if exists else None
+        if start_cursor is None:
+            start_cursor = "*"
+        elif verbose:
+            print(f"Resuming reviews for {name} from cursor {start_cursor}")
         if verbose:
             print("Getting reviews for " + name)
-        request_params['cursor'] = '*'
-        review_dict, query_count = steamreviews.download_reviews_for_app_id(int(app_id),
-                                                                        chosen_request_params=request_params,
-                                                                        query_count=query_count, 
-                                                                        verbose=True)
-        query_summary = review_dict["query_summary"]
+        completed = True
+        try:
+            for page_reviews, query_summary, next_cursor in download_review_pages(app_id, start_cursor, verbose=verbose):
+                if not exists:
+                    # the first page carries the query summary, and the game has to be inserted before its reviews because of the FK constraint
+                    process_game_data(app_id, appdata[app_id]["data"], query_summary)
+                    exists = True
+                process_game_reviews(app_id, page_reviews, next_cursor)
+        except ReviewsUnavailable as e:
+            # the cursor of the last committed page stays in review_cursors, the next run resumes from it
+            print(e.message + ", leaving the app unprocessed")
+            completed = False
+        if not exists:
+            # Steam didn't return a single page, insert the game without review counts
+            process_game_data(app_id, appdata[app_id]["data"], dict())
+        if completed:
+            mark_as_processed(app_id) # it's only fully processed when every page of reviews is processed
     else:
-        success_flag = False
-        while success_flag == False:
-            if verbose:
-                print("Getting review summary for " + name)
-            try:
-                success_flag, query_summary, query_count = steamreviews.download_reviews.download_the_full_query_summary(app_id, query_count, request_params)
-                if not success_flag:
-                    print("Sleeping 10 seconds")
-                    time.sleep(10)
-            except exceptions.ConnectionError as e:
-                print("Error " + e)
-                print("Sleeping 10 seconds")
-                time.sleep(10)
-    
-    if not exists:
+        query_summary, query_count = fetch_query_summary(app_id, query_count, verbose)
         process_game_data(app_id, appdata[app_id]["data"], query_summary)
-    
-    if reviews: # we need to execute this after process_game_data, because of the FK constraint
-        process_game_reviews(app_id, review_dict["reviews"])
-        mark_as_processed(app_id) # it's only fully processed when the reviews are processed
     if verbose:
         print("App ID: " + app_id + " done.")
     # NOTE: we should probably check the rate limits here, but we're ~10 requests under Steam official limits
@@ -142,6 +240,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Crawl game data for every game in an input file.")
     parser.add_argument("file", help="The name of the file.")
     args = parser.parse_args()
+    metrics.start(metrics_port, metrics_log_interval, "crawl_app_data")
     
     try:
         with open(args.file, "r", encoding="utf-8") as f:
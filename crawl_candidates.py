@@ -0,0 +1,66 @@
+"""
+This script crawls the candidate games found in the owned games of players, the ones owned by the most players first.
+The appdetails of a whole batch are requested concurrently and land in the response cache, so get_app_data doesn't wait on them.
+"""
+
+import asyncio
+import time
+from database import *
+from crawl_app_data import fetch_appdetails, get_app_data, ERROR, FAULTY, SUCCESS
+
+async def _prefetch_appdetails(app_ids):
+    # fetch_appdetails blocks on the rate limiter and on requests, so every app gets its own thread
+    await asyncio.gather(*(asyncio.to_thread(fetch_appdetails, app_id) for app_id in app_ids))
+
+def prefetch_appdetails(app_ids):
+    if len(app_ids) == 0:
+        return
+    asyncio.run(_prefetch_appdetails(app_ids))
+
+def crawl_candidates(batch_size=50, max_games=None, reviews=False, only_games=True, verbose=False):
+    """Crawls candidate_appids in order of count until it's empty or `max_games` candidates were crawled.
+
+    Returns:
+        int: the number of candidates crawled
+    """
+    query_count = 0
+    num_crawled = 0
+    num_new = 0
+    while max_games is None or num_crawled < max_games:
+        limit = batch_size if max_games is None else min(batch_size, max_games - num_crawled)
+        candidates = get_candidate_games(limit)
+        if len(candidates) == 0:
+            break
+        # games that already exist don't need appdetails, get_app_data only requests it for new ones
+        prefetch_appdetails([str(appid) for appid in candidates if not game_exists(appid)])
+        for appid in candidates:
+            success, query_count = get_app_data(str(appid), reviews=reviews, query_count=query_count, only_games=only_games, verbose=verbose)
+            if success == ERROR:
+                add_dead_hidden_game(appid)
+            elif success == FAULTY:
+                add_faulty_game(appid)
+            elif success == SUCCESS:
+                num_new += 1
+        # processed apps were already removed by mark_as_processed, this removes the rest
+        remove_candidate_games(candidates)
+        num_crawled += len(candidates)
+        print(f"Crawled {num_crawled} candidates, {num_new} new games (last app ID: {candidates[-1]})")
+    return num_crawled
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Crawl the candidate games owned by the most players first.")
+    parser.add_argument("-b", "--batch_size", type=int, default=50, help="Number of candidates fetched concurrently.")
+    parser.add_argument("-n", "--max_games", type=int, default=None, help="Stop after crawling this many candidates.")
+    parser.add_argument("-r", "--reviews", action="store_true", help="Crawl the reviews of every candidate too.")
+    parser.add_argument("-g", "--only_games", action="store_false", help="Only crawl games, not DLCs or other types of products.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    try:
+        start_time = time.time()
+        crawl_candidates(args.batch_size, args.max_games, args.reviews, args.only_games, args.verbose)
+        print("Done!")
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected. Exiting...")
+    finally:
+        print("Total time:", time.time() - start_time, "seconds")
@@ -7,22 +7,18 @@ Date: 2023-02-10
 import json
 import threading
 import time
-from steam import Steam
-from decouple import config, UndefinedValueError
-try:
-    KEY = config("STEAM_API_KEY")
-except UnicodeDecodeError as e:
-    print("Ensure your .env/settings.ini file is encoded in UTF-8.")
-    exit(-1)
-except UndefinedValueError as e:
-    print(e)
-    print("Tips:\r\n- You can create an .env file with 'STEAM_API_KEY=\"YOUR_API_KEY\"'.")
-    print("- You can also define an environment variable STEAM_API_KEY with your API key.")
-    exit(-1)
-steam = Steam(KEY)
+import transport
+from config import KEY
+
+def resolve_steamid(user_id):
+    if user_id.isdigit():
+        return user_id
+    response = transport.get(transport.API_URL + "/ISteamUser/ResolveVanityURL/v1/", params={"vanityurl": user_id, "key": KEY}).json()["response"]
+    return response["steamid"] if response["success"] == 1 else user_id
 
 def get_user_data(user_id):
-    response = steam.users.get_user_details(user_id, single=False)
+    user_id = resolve_steamid(user_id)
+    response = transport.get(transport.API_URL + "/ISteamUser/GetPlayerSummaries/v2/", params={"steamids": user_id, "key": KEY}).json()["response"]
     with open(f"data/single_{user_id}_data.json", "w") as f:
         json.dump(response, f, indent=4)
     player = response["players"][0]
@@ -30,7 +26,8 @@ def get_user_data(user_id):
         print("Private profile, setting basic player profile...")
         # TODO: Mark visibility as 0 in database
         return
-    owned_games = steam.users.get_owned_games(player["steamid"], include_appinfo=False)
+    owned_games = transport.get(transport.API_URL + "/IPlayerService/GetOwnedGames/v1/",
+                                params={"steamid": player["steamid"], "include_appinfo": False, "key": KEY}).json()["response"]
     if "games" not in owned_games:
         print("Game list is private, skipping...")
         # TODO: Mark visibility as 1 in database
@@ -1,8 +1,22 @@
 from typing import Any, List, Optional
+from collections import Counter
 from database_internal import *
+import metrics
+import os
 import re
+import socket
 debug = False
 from exceptions import RequiresManualIntervention
+from appid_index import AppidBitmap
+
+# appids already in game_details, loaded on the first game_exists call
+_known_appids = None
+
+def _get_known_appids():
+    global _known_appids
+    if _known_appids is None:
+        _known_appids = AppidBitmap(internal_get_all_appids())
+    return _known_appids
 
 # TODO move these 3 to database_internal.py
 def is_processed(appid):
@@ -10,15 +24,21 @@ def is_processed(appid):
     return cur.fetchone() is not None
 
 def add_dead_hidden_game(appid):
-    cur.execute("INSERT INTO game_details (appid, name) VALUES (%s, 'DEAD_HIDDEN_GAME');", (appid,))
+    cur.execute("INSERT IGNORE INTO game_details (appid, name) VALUES (%s, 'DEAD_HIDDEN_GAME');", (appid,))
     connection.commit()
+    _get_known_appids().add(appid)
 
 def add_faulty_game(appid):
-    cur.execute("INSERT INTO game_details (appid, name) VALUES (%s, 'FAULTY_GAME');", (appid,))
+    cur.execute("INSERT IGNORE INTO game_details (appid, name) VALUES (%s, 'FAULTY_GAME');", (appid,))
     connection.commit()
+    _get_known_appids().add(appid)
 
-def process_game_data(appid, appdetails, query_summary):
-    print(f"Inserting game with appid {appid} into the database")
+def _get_game_details(appdetails, query_summary):
+    """Computes the game_details row of a game and its genres, categories, developers and publishers.
+
+    Returns:
+        tuple: (details, genres, categories, developers, publishers), details is every game_details column from name to coming_soon
+    """
     name = appdetails["name"]
     # EA's Mass Effect Legendary Edition has a required_age of 17+ instead of just 17, this regex fixes that
     required_age = int(re.sub(r"\D", "", str(appdetails["required_age"]))) if "required_age" in appdetails else 0
@@ -39,7 +59,6 @@ def process_game_data(appid, appdetails, query_summary):
     publishers = appdetails["publishers"] if "publishers" in appdetails else []
     # print all variables for debugging purposes
     if debug:
-        print(f"appid: {appid}")
         print(f"name: {name}")
         print(f"required_age: {required_age}")
         print(f"is_free: {is_free}")
@@ -57,29 +76,100 @@ def process_game_data(appid, appdetails, query_summary):
         print(f"genres: {genres}")
         print(f"developers: {developers}")
         print(f"publishers: {publishers}")
+    details = (name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon)
+    return details, genres, categories, developers, publishers
+
+def process_game_data(appid, appdetails, query_summary):
+    print(f"Inserting game with appid {appid} into the database")
+    details, genres, categories, developers, publishers = _get_game_details(appdetails, query_summary)
+    if debug:
+        print(f"appid: {appid}")
     # insert into database
-    internal_insert_game_details(appid, name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon)
+    internal_insert_game_details(appid, *details)
     internal_insert_game_genres(appid, genres)
     internal_insert_game_categories(appid, categories)
     # TODO: delete developers and publishers before inserting, in case they changed (Ready or Not (T17 -> VOID), WW3...)
     internal_insert_game_developers(appid, developers)
     internal_insert_game_publishers(appid, publishers)
     connection.commit()
+    _get_known_appids().add(appid)
+
+def refresh_game_data(appid, appdetails, query_summary):
+    """Updates a game that's already in the database, writing only what changed since it was retrieved.
+
+    game_details is only updated (and its date_retrieved bumped) when one of its values changed,
+    and each relation table (genres, categories, developers, publishers) is only rewritten when its set of ids changed.
+
+    Returns:
+        bool: True if anything was written, False if the stored data was already up to date
+    """
+    details, genres, categories, developers, publishers = _get_game_details(appdetails, query_summary)
+    # bit columns come back as 0/1, and bools compare equal to them
+    stored_details = internal_get_game_details_row(appid)
+    details_changed = stored_details is None or tuple(stored_details) != details
+    if details_changed:
+        internal_update_game_details(appid, *details)
+    changed = details_changed
+    new_ids = {
+        "game_genres": {int(genre["id"]) for genre in genres},
+        "game_categories": {int(category["id"]) for category in categories},
+        "game_developers": set(internal_get_developer_ids(developers)),
+        "game_publishers": set(internal_get_publisher_ids(publishers)),
+    }
+    for table, ids in new_ids.items():
+        if set(internal_get_game_relation_ids(table, appid)) == ids:
+            continue
+        changed = True
+        internal_delete_game_relations(table, appid)
+        if table == "game_genres":
+            internal_insert_game_genres(appid, genres)
+        elif table == "game_categories":
+            internal_insert_game_categories(appid, categories)
+        elif table == "game_developers":
+            internal_insert_game_developers(appid, developers)
+        else:
+            internal_insert_game_publishers(appid, publishers)
+    if changed and not details_changed:
+        internal_touch_games([appid])
+    connection.commit()
+    return changed
+
+def get_stale_games(max_age_days, limit, most_reviewed_first=False):
+    """Returns the appids of up to `limit` games retrieved more than `max_age_days` days ago,
+    the stalest first or, with most_reviewed_first, the ones with the most reviews first."""
+    return internal_get_stale_games(max_age_days, limit, most_reviewed_first)
+
+def add_refresh_indexes():
+    """Adds the date_retrieved indexes of game_details and player_data. Only needed once, to migrate a database created before the refreshes."""
+    internal_add_refresh_indexes()
+    connection.commit()
+
+def touch_games(appids):
+    """Bumps date_retrieved of games that were checked and didn't change, so they go to the back of the refresh queue."""
+    if len(appids) == 0:
+        return
+    internal_touch_games(appids)
+    connection.commit()
 
-def process_game_reviews(app_id, review_dict):
+def process_game_reviews(app_id, review_dict, next_cursor=None):
     """Processes game reviews and inserts partial information into player_games table.
 
+    Every table is written with multi-row upserts, and everything is committed at once.
+
     Args:
         app_id (str | int): the app id of the game
         review_dict (dict): the dictionary containing the review data, returned from steamreviews download method
+        next_cursor (str, optional): the cursor of the page after these reviews, stored in the same transaction to resume from it
     """
     # print(f"Inserting game reviews with appid {app_id} into the database")
+    player_rows = []
+    review_rows = []
+    player_game_rows = []
     for recommendationid, review in review_dict.items():
         try:
             steamid = review["author"]["steamid"]
             num_games_owned = review["author"]["num_games_owned"]
             num_reviews = review["author"]["num_reviews"]
-            process_partial_player_from_review(steamid, num_games_owned, num_reviews)
             playtime_at_review = review["author"]["playtime_at_review"] if "playtime_at_review" in review["author"] else 0
             playtime_forever = review["author"]["playtime_forever"] if "playtime_forever" in review["author"] else 0
             voted_up = review["voted_up"]
@@ -93,8 +183,18 @@ def process_game_reviews(app_id, review_dict):
             print(f"Error processing review with recommendationid {recommendationid}: {e}")
             print(review)
             raise e
-        process_game_review(recommendationid, steamid, app_id, voted_up, timestamp_created, timestamp_updated, playtime_at_review, playtime_forever,  received_for_free, steam_purchase, written_during_early_access, last_played)
+        player_rows.append((steamid, num_games_owned, num_reviews))
+        review_rows.append((recommendationid, steamid, app_id, voted_up, timestamp_created, timestamp_updated, playtime_at_review, received_for_free, steam_purchase, written_during_early_access))
+        player_game_rows.append((steamid, app_id, playtime_forever, None, None, None, last_played))
+    # players first, because of the FK constraints of the other tables
+    internal_insert_partial_players(player_rows)
+    internal_enqueue_players([(steamid, num_games_owned) for steamid, num_games_owned, _ in player_rows])
+    internal_insert_player_game_reviews(review_rows)
+    internal_insert_player_games(player_game_rows)
+    if next_cursor is not None:
+        internal_update_review_cursor(app_id, next_cursor)
     connection.commit()
+    metrics.inc("reviews_written_total", len(review_rows))
 
 def process_partial_player_from_review(steamid, num_games_owned, num_reviews):
     #print(f"Inserting player with steamid {steamid} into the database")
@@ -109,11 +209,111 @@ def process_game_review(recommendationid, steamid, appid, voted_up, timestamp_cr
     #print(f"Inserting player game review with recommendationid {recommendationid} into the database")
     internal_insert_player_game_review(recommendationid, steamid, appid, voted_up, timestamp_created, timestamp_updated, playtime_at_review, playtime_forever,  received_for_free, steam_purchase, written_during_early_access, last_played)
 
+def get_review_cursor(appid):
+    return internal_get_review_cursor(appid)
+
+default_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+def claim_unprocessed_players(worker_id=default_worker_id, batch_size=100, lease_seconds=1800):
+    """Leases a batch of players from player_crawl_queue, in order of num_games_owned.
+
+    Batches claimed by different workers never overlap. Players are removed from the queue by process_steam_user,
+    players whose lease expires before that are handed out again.
+
+    Returns:
+        list[tuple]: (steamid,) for every claimed player
+    """
+    return internal_claim_players(worker_id, batch_size, lease_seconds)
+
+def extend_player_lease(worker_id=default_worker_id, lease_seconds=1800):
+    """Leases the players of worker_id that are still in player_crawl_queue for lease_seconds more, so a batch that takes
+    longer than its lease isn't handed out to another worker while it's still being crawled.
+
+    Returns:
+        int: number of players whose lease was extended
+    """
+    num_players = internal_extend_lease(worker_id, lease_seconds)
+    connection.commit()
+    return num_players
+
 def get_100_unprocessed_players():
-    return internal_get_unprocessed_players()
+    return claim_unprocessed_players()
+
+def enqueue_unprocessed_players():
+    """Adds every player without a visibility to player_crawl_queue. Only needed once, to fill the queue of an existing database."""
+    num_players = internal_enqueue_unprocessed_players()
+    connection.commit()
+    return num_players
+
+def enqueue_stale_players(max_age_days):
+    """Adds every crawled player whose data is older than `max_age_days` days to player_crawl_queue, to refresh their owned games."""
+    num_players = internal_enqueue_stale_players(max_age_days)
+    connection.commit()
+    return num_players
+
+def report_worker(worker_id, players_processed, players_per_second):
+    internal_report_worker(worker_id, players_processed, players_per_second)
+    connection.commit()
+
+def remove_players_from_queue(steamids):
+    for steamid in steamids:
+        internal_dequeue_player(steamid)
+    connection.commit()
+
+def get_statement_count():
+    """Returns the number of statements this connection has sent to MySQL, used by the benchmarks."""
+    return internal_get_statement_count()
+
+def get_queue_depth():
+    """Returns the approximate number of players in player_crawl_queue."""
+    depth = internal_get_queue_depth()
+    connection.commit()
+    return depth
 
 def get_game_data(appid):
-    return internal_get_game_data(appid)
+    game_data = internal_get_game_data(appid)
+    if game_data is not None:
+        # another crawler might have inserted it after we loaded the known appids
+        _get_known_appids().add(appid)
+    return game_data
+
+def get_game_prices(after_appid, limit):
+    """Returns (appid, price_usd, is_free) for the next `limit` games after `after_appid`, in appid order."""
+    return internal_get_game_prices(after_appid, limit)
+
+def update_game_prices(rows):
+    """Updates price_usd and is_free from (price_usd, is_free, appid) rows, in a single commit."""
+    if len(rows) == 0:
+        return
+    internal_update_game_prices(rows)
+    connection.commit()
+
+def add_export_columns():
+    """Adds date_retrieved to player_games and player_game_reviews. Only needed once, to migrate a database created before the snapshot exports."""
+    internal_add_export_columns()
+    connection.commit()
+
+def export_player_games(after_steamid, after_appid, since, limit):
+    """Returns the next `limit` player_games rows after (after_steamid, after_appid) that changed at or after `since`,
+    with rtime_last_played as a unix timestamp."""
+    return internal_export_player_games(after_steamid, after_appid, since, limit)
+
+def export_player_game_reviews(after_recommendationid, since, limit):
+    """Returns the next `limit` player_game_reviews rows after `after_recommendationid` that changed at or after `since`,
+    with bits as 0/1 and timestamps as unix timestamps."""
+    return internal_export_player_game_reviews(after_recommendationid, since, limit)
+
+def export_crawled_player_games(after_steamid, after_appid, limit):
+    """Returns (steamid, appid, playtime_forever) for the next `limit` player_games rows after (after_steamid, after_appid)
+    of players with a public game list, the same players get_players_retrieved_since returns."""
+    return internal_export_crawled_player_games(after_steamid, after_appid, limit)
+
+def get_players_retrieved_since(since, after_steamid, limit):
+    """Returns the steamids of the next `limit` players after `after_steamid` with a public game list, crawled at or after `since`."""
+    return internal_get_players_retrieved_since(since, after_steamid, limit)
+
+def get_database_time():
+    return internal_get_database_time()
 
 def get_game_data_from_name(name: str) -> int:
     game_data = internal_get_game_data_from_name(name)
@@ -127,7 +327,8 @@ def get_game_data_from_name(name: str) -> int:
     
 
 def game_exists(appid):
-    return internal_get_game_data(appid) is not None
+    # no round trip: games inserted by other processes are found later by get_game_data, inside get_app_data
+    return appid in _get_known_appids()
 
 def process_steam_user(steamid, personaname, visibility, num_games_owned = 0, commentpermission=None, primaryclanid=None, timecreated=None, loccountrycode=None, locstatecode=None, loccityid=None):
     player_row = internal_get_player(steamid)
@@ -140,13 +341,78 @@ def process_steam_user(steamid, personaname, visibility, num_games_owned = 0, co
     else:
         # we can't really know how many reviews they have which is why we set it to 0
         internal_insert_player_data(steamid, personaname, visibility, commentpermission, primaryclanid, timecreated, loccountrycode, locstatecode, loccityid, num_games_owned, num_reviews=0)
+    internal_dequeue_player(steamid)
     connection.commit()
 
 def insert_player_game_data(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played):
-    insert_candidate_game(appid)
+    internal_insert_or_update_candidate_game(appid)
     internal_insert_player_game(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played)
     connection.commit()
 
+_player_games_buffer = []
+# appid -> number of players that own it, written once per batch by flush_candidate_games
+_candidate_counts = Counter()
+
+def buffer_player_game_data(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played, new_game=True):
+    """Same as insert_player_game_data, but the row is only written on the next flush_player_game_data call.
+
+    Rows of games the player already had stored (new_game=False) don't count towards candidate_appids again.
+    """
+    _player_games_buffer.append((steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played))
+    if new_game:
+        _candidate_counts[appid] += 1
+
+def flush_player_game_data():
+    """Writes every buffered player_games row with multi-row upserts and a single commit.
+
+    The candidate_appids counts of the rows are kept in memory until flush_candidate_games is called.
+
+    Returns:
+        int: the number of rows written
+    """
+    num_rows = len(_player_games_buffer)
+    if num_rows == 0:
+        return 0
+    internal_insert_player_games(_player_games_buffer)
+    connection.commit()
+    _player_games_buffer.clear()
+    return num_rows
+
+def flush_candidate_games():
+    """Adds the counts accumulated by buffer_player_game_data to candidate_appids, one row per appid, in a single commit.
+
+    Returns:
+        int: the number of appids written
+    """
+    num_appids = len(_candidate_counts)
+    if num_appids == 0:
+        return 0
+    internal_insert_or_update_candidate_games(_candidate_counts)
+    connection.commit()
+    _candidate_counts.clear()
+    return num_appids
+
+def get_candidate_games(limit):
+    """Returns the appids of the `limit` candidates owned by the most players."""
+    return internal_get_candidate_games(limit)
+
+def remove_candidate_games(appids):
+    if len(appids) == 0:
+        return
+    internal_delete_candidate_games(appids)
+    connection.commit()
+
+def get_player_games(steamids):
+    """Returns the stored games of many players at once.
+
+    Returns:
+        dict: steamid (str) -> {appid: (playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played)}
+    """
+    player_games = {str(steamid): dict() for steamid in steamids}
+    for steamid, appid, *values in internal_get_player_games(steamids):
+        player_games[str(steamid)][appid] = tuple(values)
+    return player_games
+
 def insert_candidate_game(appid):
     #print(f"Inserting candidate game with appid {appid} into the database")
     internal_insert_or_update_candidate_game(appid)
@@ -163,9 +429,35 @@ def insert_game_tags(appid: int, tags: List[str], max_len = 1, force_refresh: bo
         # this is to ensure we don't have two tags with the same priority and no repeated tags, 
         # otherwise you *might* have two tags with the same priority or one tag that's no longer in the list
         internal_delete_old_game_tags(appid)
-    for tag in tags:
-        tagid = internal_get_tagid_from_name(tag)
-        if tagid is None:
-            tagid = internal_insert_new_tag(tag['name'])
-        internal_insert_game_tag(appid, tagid, priority=((max_len-tags.index(tag))/max_len), ignore=not force_refresh)
-    connection.commit()
\ No newline at end of file
+    tagids = internal_get_tagids_from_names(tags)
+    internal_insert_game_tags([(appid, tagids[tag], (max_len - position) / max_len) for position, tag in enumerate(tags)])
+    internal_touch_game_tags([appid])
+    connection.commit()
+
+def get_tagids(names):
+    """Returns name -> tagid for every tag name, inserting the new ones, in a single commit."""
+    tagids = internal_get_tagids_from_names(names)
+    connection.commit()
+    return tagids
+
+def add_tags_retrieved_column():
+    """Adds tags_retrieved to game_details. Only needed once, to migrate a database created before the tag refreshes."""
+    internal_add_tags_retrieved_column()
+    connection.commit()
+
+def touch_game_tags(appids):
+    """Sets tags_retrieved of the games to now without changing their tags."""
+    internal_touch_game_tags(appids)
+    connection.commit()
+
+def replace_game_tags(appids, rows):
+    """Replaces the tags of many games at once, in a single transaction.
+
+    Args:
+        appids (list[int]): the games whose tags are replaced, games without rows end up without tags
+        rows (list[tuple]): (appid, tagid, priority) for every tag of the games
+    """
+    internal_delete_game_tags(appids)
+    internal_insert_game_tags(rows)
+    internal_touch_game_tags(appids)
+    connection.commit()
@@ -21,6 +21,15 @@ CREATE TABLE IF NOT EXISTS `categories` (
   PRIMARY KEY (`category_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Steam provides ID for categories, thus we don''t need a secondary key on the name';
 
+CREATE TABLE IF NOT EXISTS `crawler_workers` (
+  `worker_id` varchar(64) NOT NULL COMMENT 'host:pid',
+  `players_processed` int(10) unsigned NOT NULL DEFAULT 0,
+  `players_per_second` float NOT NULL DEFAULT 0,
+  `started` datetime NOT NULL DEFAULT current_timestamp(),
+  `last_seen` datetime NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`worker_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Throughput reported by every player crawler worker after each batch';
+
 CREATE TABLE IF NOT EXISTS `developers` (
   `developer_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `developer_name` varchar(256) NOT NULL,
@@ -55,7 +64,10 @@ CREATE TABLE IF NOT EXISTS `game_details` (
   `release_date` varchar(64) DEFAULT NULL COMMENT 'Developers can set it to Coming Soon or various formats',
   `coming_soon` bit(1) NOT NULL DEFAULT b'0',
   `date_retrieved` datetime DEFAULT current_timestamp(),
-  PRIMARY KEY (`appid`)
+  `tags_retrieved` datetime DEFAULT NULL COMMENT 'Last time the tags of the game were scraped, NULL if they never were',
+  PRIMARY KEY (`appid`),
+  KEY `date_retrieved` (`date_retrieved`),
+  KEY `tags_retrieved` (`tags_retrieved`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Game details provided via the Steam API';
 
 CREATE TABLE IF NOT EXISTS `game_developers` (
@@ -105,6 +117,16 @@ CREATE TABLE IF NOT EXISTS `genres` (
   PRIMARY KEY (`genre_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Valve provides IDs for genres, it''s just ID -> genre';
 
+CREATE TABLE IF NOT EXISTS `player_crawl_queue` (
+  `steamid` bigint(20) unsigned NOT NULL,
+  `priority` smallint(5) unsigned NOT NULL DEFAULT 0 COMMENT 'num_games_owned, lower goes first',
+  `lease_owner` varchar(64) DEFAULT NULL COMMENT 'host:pid of the worker crawling this player',
+  `lease_expires` datetime NOT NULL DEFAULT '1970-01-01 00:00:01',
+  PRIMARY KEY (`steamid`),
+  KEY `priority_lease` (`priority`,`lease_expires`),
+  CONSTRAINT `steamid_queue_fk` FOREIGN KEY (`steamid`) REFERENCES `player_data` (`steamid`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Players left to crawl. Workers lease batches of them, leases that expire go back to the queue';
+
 CREATE TABLE IF NOT EXISTS `player_data` (
   `steamid` bigint(20) unsigned NOT NULL,
   `personaname` varchar(64) DEFAULT NULL,
@@ -120,7 +142,8 @@ CREATE TABLE IF NOT EXISTS `player_data` (
   `date_retrieved` datetime NOT NULL DEFAULT current_timestamp(),
   PRIMARY KEY (`steamid`),
   KEY `primaryclanid` (`primaryclanid`),
-  KEY `visibility` (`visibility`)
+  KEY `visibility` (`visibility`),
+  KEY `date_retrieved` (`date_retrieved`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Data retrieved from Steam. Only users with public profiles were crawled.';
 
 CREATE TABLE IF NOT EXISTS `player_games` (
@@ -131,6 +154,7 @@ CREATE TABLE IF NOT EXISTS `player_games` (
   `playtime_mac` int(10) unsigned DEFAULT NULL,
   `playtime_linux` int(10) unsigned DEFAULT NULL,
   `rtime_last_played` timestamp NOT NULL,
+  `date_retrieved` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp() COMMENT 'Only changes when a value changes, used by incremental exports',
   PRIMARY KEY (`steamid`,`appid`),
   KEY `steamid_pdata` (`steamid`),
   KEY `appid_pdata` (`appid`),
@@ -149,6 +173,7 @@ CREATE TABLE IF NOT EXISTS `player_game_reviews` (
   `received_for_free` bit(1) NOT NULL,
   `steam_purchase` bit(1) NOT NULL,
   `written_during_early_access` bit(1) NOT NULL,
+  `date_retrieved` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp() COMMENT 'Only changes when a value changes, used by incremental exports',
   PRIMARY KEY (`recommendationid`),
   UNIQUE KEY `steamid_appid_unique_reviews` (`steamid`,`appid`),
   KEY `steamid_reviews` (`steamid`),
@@ -173,6 +198,14 @@ CREATE TABLE IF NOT EXISTS `publishers` (
   KEY `publisher_name` (`publisher_name`) USING BTREE
 ) ENGINE=InnoDB AUTO_INCREMENT=14334 DEFAULT CHARSET=utf8mb4 COMMENT='ID -> developer name, name -> ID (the API returns a name, we need this as an indexed key too)';
 
+CREATE TABLE IF NOT EXISTS `review_cursors` (
+  `appid` int(10) unsigned NOT NULL,
+  `next_cursor` varchar(128) NOT NULL,
+  `last_updated` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  PRIMARY KEY (`appid`),
+  CONSTRAINT `review_cursor_appid` FOREIGN KEY (`appid`) REFERENCES `game_details` (`appid`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Cursor of the next page of reviews to download, for apps whose reviews are still being crawled';
+
 CREATE TABLE IF NOT EXISTS `tags` (
   `tagid` int(10) unsigned NOT NULL AUTO_INCREMENT,
   `name` varchar(60) DEFAULT NULL,
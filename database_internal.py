@@ -1,17 +1,29 @@
 import mysql.connector
 import time
+from collections import ChainMap
+from decouple import config
+import metrics
 
 # Diagram of the database
 # https://dbdiagram.io/d/63f6302d296d97641d82f22a
 
-connection = mysql.connector.connect(
-  host="localhost",
-  user="root",
-  password="root",
-  database="steam_tfg_jgg"
-)
+# crawlers on other hosts can point at the same database through the .env file or environment variables
+def internal_connect():
+    """Opens a new connection to the database, for code that runs in another thread than the one using `connection`."""
+    return mysql.connector.connect(
+      host=config("DB_HOST", default="localhost"),
+      port=config("DB_PORT", default=3306, cast=int),
+      user=config("DB_USER", default="root"),
+      password=config("DB_PASSWORD", default="root"),
+      database=config("DB_NAME", default="steam_tfg_jgg")
+    )
+
+connection = internal_connect()
 cur = connection.cursor()
 
+# rows per multi-row statement of the executemany calls, keeps every statement well under max_allowed_packet
+_insert_many_chunk_size = 1000
+
 _insert_player_data_cursor = connection.cursor(prepared=True)
 _fetch_player_data_cursor = connection.cursor(prepared=True)
 
@@ -83,13 +95,82 @@ def internal_update_player_data(steamid, personaname, visibility, commentpermiss
 def internal_insert_partial_player_data(steamid, num_games_owned, num_reviews):
     internal_insert_player_data(steamid, None, None, None, None, None, None, None, num_games_owned, num_reviews, None)
 
-_get_unprocessed_players_cursor = connection.cursor(prepared=True)
+_insert_many_player_data_cursor = connection.cursor()
+
+_insert_many_player_data_stmt = _insert_player_data_stmt.replace("?", "%s")
+
+def internal_insert_partial_players(rows):
+    rows = [(steamid, None, None, None, None, None, None, None, num_games_owned, num_reviews, None) for steamid, num_games_owned, num_reviews in rows]
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _insert_many_player_data_cursor.executemany(_insert_many_player_data_stmt, rows[i:i + _insert_many_chunk_size])
+
+# Players left to crawl live in player_crawl_queue. Workers lease batches from it instead of sorting every
+# player_data row with visibility IS NULL, and a lease that isn't completed in time goes back to the queue
+_player_queue_cursor = connection.cursor(prepared=True)
+
+_claim_players_stmt = "SELECT steamid FROM player_crawl_queue "\
+    "WHERE lease_expires < NOW() "\
+    "ORDER BY priority LIMIT ? FOR UPDATE SKIP LOCKED;"
+
+_lease_players_stmt = "UPDATE player_crawl_queue "\
+    "SET lease_owner = %s, lease_expires = NOW() + INTERVAL %s SECOND "\
+    "WHERE steamid IN ({});"
+
+_enqueue_players_stmt = "INSERT INTO player_crawl_queue (steamid, priority) VALUES (%s, %s) "\
+    "ON DUPLICATE KEY UPDATE priority = VALUES(priority);"
+
+_enqueue_unprocessed_players_stmt = "INSERT IGNORE INTO player_crawl_queue (steamid, priority) "\
+    "SELECT steamid, num_games_owned FROM player_data WHERE visibility IS NULL;"
+
+# players crawled more than N days ago go back to the queue to get their owned games refreshed
+_enqueue_stale_players_stmt = "INSERT IGNORE INTO player_crawl_queue (steamid, priority) "\
+    "SELECT steamid, num_games_owned FROM player_data WHERE visibility IS NOT NULL AND date_retrieved < NOW() - INTERVAL %s DAY;"
+
+_dequeue_player_stmt = "DELETE FROM player_crawl_queue WHERE steamid = ?;"
+
+# crawled players are already out of the queue, and a batch whose lease expired and was claimed by another worker has another owner
+_extend_lease_stmt = "UPDATE player_crawl_queue "\
+    "SET lease_expires = NOW() + INTERVAL ? SECOND "\
+    "WHERE lease_owner = ?;"
 
-_get_unprocessed_players_stmt = "SELECT steamid FROM player_data WHERE visibility IS NULL ORDER BY num_games_owned LIMIT 100;"
+def internal_claim_players(worker_id, batch_size, lease_seconds):
+    # SKIP LOCKED lets other workers claim the next rows while this transaction is still open
+    _player_queue_cursor.execute(_claim_players_stmt, (batch_size,))
+    steamids = [row[0] for row in _player_queue_cursor.fetchall()]
+    if len(steamids) > 0:
+        cur.execute(_lease_players_stmt.format(", ".join(["%s"] * len(steamids))), (worker_id, lease_seconds, *steamids))
+    connection.commit()
+    return [(steamid,) for steamid in steamids]
 
-def internal_get_unprocessed_players():
-    _get_unprocessed_players_cursor.execute(_get_unprocessed_players_stmt)
-    return _get_unprocessed_players_cursor.fetchall()
+def internal_extend_lease(worker_id, lease_seconds):
+    _player_queue_cursor.execute(_extend_lease_stmt, (lease_seconds, worker_id))
+    return _player_queue_cursor.rowcount
+
+_enqueue_players_cursor = connection.cursor()
+
+def internal_enqueue_players(rows):
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _enqueue_players_cursor.executemany(_enqueue_players_stmt, rows[i:i + _insert_many_chunk_size])
+
+def internal_enqueue_unprocessed_players():
+    cur.execute(_enqueue_unprocessed_players_stmt)
+    return cur.rowcount
+
+def internal_enqueue_stale_players(max_age_days):
+    cur.execute(_enqueue_stale_players_stmt, (max_age_days,))
+    return cur.rowcount
+
+def internal_dequeue_player(steamid):
+    _player_queue_cursor.execute(_dequeue_player_stmt, (steamid,))
+
+_report_worker_stmt = "INSERT INTO crawler_workers (worker_id, players_processed, players_per_second) VALUES (?, ?, ?) "\
+    "ON DUPLICATE KEY UPDATE "\
+    "players_processed = VALUES(players_processed), "\
+    "players_per_second = VALUES(players_per_second), "\
+    "last_seen = CURRENT_TIMESTAMP;"
+
+def internal_report_worker(worker_id, players_processed, players_per_second):
+    _player_queue_cursor.execute(_report_worker_stmt, (worker_id, players_processed, players_per_second))
 
 _insert_game_details_cursor = connection.cursor(prepared=True)
 
@@ -113,95 +194,225 @@ _insert_game_details_stmt = "INSERT INTO game_details "\
 def internal_insert_game_details(appid, name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon):
     _insert_game_details_cursor.execute(_insert_game_details_stmt, (appid, name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon))
 
-_insert_game_genres_cursor = connection.cursor(prepared=True)
+# Dimension tables are small and almost never change, so they're loaded once and kept in memory:
+# name -> id for developers, publishers and tags, id -> description for genres and categories
+_load_dimension_stmts = {
+    "genres": "SELECT genre_id, genre_description FROM genres;",
+    "categories": "SELECT category_id, category_description FROM categories;",
+    "developers": "SELECT developer_name, developer_id FROM developers;",
+    "publishers": "SELECT publisher_name, publisher_id FROM publishers;",
+    # tag names aren't unique, the lowest tagid is the one that gets kept
+    "tags": "SELECT name, tagid FROM tags WHERE name IS NOT NULL ORDER BY tagid DESC;",
+}
 
-_insert_game_genres_stmt = "INSERT IGNORE INTO game_genres "\
-    "(appid, genre_id) "\
-    "VALUES (?, ?);"
+_dimension_cache = dict()
+# rows written or read by the open transaction only become part of the cache when it commits, a rollback would leave their ids pointing to nothing
+_uncommitted_dimension_entries = dict()
 
-_insert_genre_cursor = connection.cursor(prepared=True)
+def internal_get_dimension_cache(table):
+    """Returns the cache of a dimension table. New entries go to the open transaction and are kept or dropped when it ends."""
+    if table not in _dimension_cache:
+        cur.execute(_load_dimension_stmts[table])
+        _dimension_cache[table] = {key: value for key, value in cur}
+        _uncommitted_dimension_entries[table] = dict()
+    return ChainMap(_uncommitted_dimension_entries[table], _dimension_cache[table])
 
-_insert_genre_stmt = "INSERT IGNORE INTO genres VALUES (?, ?);"
+_commit_connection = connection.commit
+_rollback_connection = connection.rollback
 
-def internal_insert_game_genres(appid, genres):
-    for genre in genres:
-        _insert_genre_cursor.execute(_insert_genre_stmt, (genre["id"], genre["description"]))
-        _insert_game_genres_cursor.execute(_insert_game_genres_stmt, (appid, genre["id"]))
+def _commit_and_keep_dimension_entries():
+    _commit_connection()
+    for table, entries in _uncommitted_dimension_entries.items():
+        _dimension_cache[table].update(entries)
+        entries.clear()
 
-_insert_game_categories_cursor = connection.cursor(prepared=True)
+def _rollback_and_drop_dimension_entries():
+    _rollback_connection()
+    for entries in _uncommitted_dimension_entries.values():
+        entries.clear()
 
-_insert_game_categories_stmt = "INSERT IGNORE INTO game_categories "\
-    "(appid, category_id) "\
-    "VALUES (?, ?);"
+connection.commit = _commit_and_keep_dimension_entries
+connection.rollback = _rollback_and_drop_dimension_entries
 
-_insert_category_cursor = connection.cursor(prepared=True)
+# placeholder rows inserted by add_dead_hidden_game and add_faulty_game have no details to refresh
+_get_game_prices_stmt = "SELECT appid, price_usd, is_free + 0 FROM game_details "\
+    "WHERE appid > ? AND name NOT IN ('DEAD_HIDDEN_GAME', 'FAULTY_GAME') "\
+    "ORDER BY appid LIMIT ?;"
 
-_insert_category_stmt = "INSERT IGNORE INTO categories VALUES (?, ?);"
+_game_prices_cursor = connection.cursor(prepared=True)
 
-def internal_insert_game_categories(appid, categories):
-    for category in categories:
-        _insert_category_cursor.execute(_insert_category_stmt, (category["id"], category["description"]))
-        _insert_game_categories_cursor.execute(_insert_game_categories_stmt, (appid, category["id"]))
+def internal_get_game_prices(after_appid, limit):
+    _game_prices_cursor.execute(_get_game_prices_stmt, (after_appid, limit))
+    return _game_prices_cursor.fetchall()
 
-_insert_game_developers_cursor = connection.cursor(prepared=True)
+_update_game_prices_cursor = connection.cursor()
 
-_insert_game_developers_stmt = "INSERT IGNORE INTO game_developers "\
-    "(appid, developer_id) "\
-    "VALUES (?, ?);"
+_update_game_price_stmt = "UPDATE game_details SET price_usd = %s, is_free = %s WHERE appid = %s;"
 
-_get_developer_id_cursor = connection.cursor(prepared=True)
+def internal_update_game_prices(rows):
+    _update_game_prices_cursor.executemany(_update_game_price_stmt, rows)
 
-_get_developer_id_stmt = "SELECT developer_id FROM developers WHERE developer_name = ?;"
+_game_details_columns = "name, required_age, is_free + 0, controller_support, has_demo + 0, price_usd, mac_os + 0, positive_reviews, negative_reviews, total_reviews, has_achievements + 0, release_date, coming_soon + 0"
 
-_insert_developer_cursor = connection.cursor(prepared=True)
+_get_stalest_games_stmt = "SELECT appid FROM game_details "\
+    "WHERE date_retrieved < NOW() - INTERVAL ? DAY AND name NOT IN ('DEAD_HIDDEN_GAME', 'FAULTY_GAME') "\
+    "ORDER BY date_retrieved LIMIT ?;"
 
-_insert_developer_stmt = "INSERT INTO developers (developer_name) VALUES (?);"
+# total_reviews is the closest thing to the number of owners that we store for every game
+_get_most_reviewed_stale_games_stmt = "SELECT appid FROM game_details "\
+    "WHERE date_retrieved < NOW() - INTERVAL ? DAY AND name NOT IN ('DEAD_HIDDEN_GAME', 'FAULTY_GAME') "\
+    "ORDER BY total_reviews DESC LIMIT ?;"
 
-_get_next_autoincrement_id_cursor = connection.cursor(prepared=True)
+_stale_games_cursor = connection.cursor(prepared=True)
 
-_get_next_autoincrement_id_stmt = "SELECT AUTO_INCREMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = 'steam_tfg_jgg' AND TABLE_NAME = 'developers';"
+def internal_get_stale_games(max_age_days, limit, most_reviewed_first=False):
+    stmt = _get_most_reviewed_stale_games_stmt if most_reviewed_first else _get_stalest_games_stmt
+    _stale_games_cursor.execute(stmt, (max_age_days, limit))
+    return [row[0] for row in _stale_games_cursor.fetchall()]
 
-def internal_insert_game_developers(appid, developers: list[str]):
-    for developer in developers:
-        _get_developer_id_cursor.execute(_get_developer_id_stmt, (developer,))
-        developer_id = _get_developer_id_cursor.fetchone()
-        if developer_id is None: # doesn't exist
-            _get_next_autoincrement_id_cursor.execute(_get_next_autoincrement_id_stmt)
-            developer_id = _get_next_autoincrement_id_cursor.fetchone()
-            _insert_developer_cursor.execute(_insert_developer_stmt, (developer,))
-            connection.commit() # we need commit for the next row to not violate the foreign key constraint
-        developer_id = developer_id[0]
-        _insert_game_developers_cursor.execute(_insert_game_developers_stmt, (appid, developer_id))
-
-_insert_game_publishers_cursor = connection.cursor(prepared=True)
+_get_game_details_row_stmt = "SELECT " + _game_details_columns + " FROM game_details WHERE appid = ?;"
 
-_insert_game_publishers_stmt = "INSERT IGNORE INTO game_publishers "\
-    "(appid, publisher_id) "\
-    "VALUES (?, ?);"
+def internal_get_game_details_row(appid):
+    _stale_games_cursor.execute(_get_game_details_row_stmt, (appid,))
+    return _stale_games_cursor.fetchone()
+
+_update_game_details_cursor = connection.cursor(prepared=True)
+
+_update_game_details_stmt = "UPDATE game_details SET "\
+    "name = ?, required_age = ?, is_free = ?, controller_support = ?, has_demo = ?, price_usd = ?, mac_os = ?, "\
+    "positive_reviews = ?, negative_reviews = ?, total_reviews = ?, has_achievements = ?, release_date = ?, coming_soon = ?, "\
+    "date_retrieved = CURRENT_TIMESTAMP WHERE appid = ?;"
+
+def internal_update_game_details(appid, name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon):
+    _update_game_details_cursor.execute(_update_game_details_stmt, (name, required_age, is_free, controller_support, has_demo, price_usd, mac_os, positive_reviews, negative_reviews, total_reviews, has_achievements, release_date, coming_soon, appid))
+
+_touch_games_cursor = connection.cursor()
+
+def internal_touch_games(appids):
+    for i in range(0, len(appids), _insert_many_chunk_size):
+        chunk = appids[i:i + _insert_many_chunk_size]
+        _touch_games_cursor.execute("UPDATE game_details SET date_retrieved = CURRENT_TIMESTAMP WHERE appid IN (" + ", ".join(["%s"] * len(chunk)) + ");", chunk)
+
+# relation table -> (statement to get the ids of a game, statement to delete them)
+_game_relation_stmts = {
+    "game_genres": ("SELECT genre_id FROM game_genres WHERE appid = %s;", "DELETE FROM game_genres WHERE appid = %s;"),
+    "game_categories": ("SELECT category_id FROM game_categories WHERE appid = %s;", "DELETE FROM game_categories WHERE appid = %s;"),
+    "game_developers": ("SELECT developer_id FROM game_developers WHERE appid = %s;", "DELETE FROM game_developers WHERE appid = %s;"),
+    "game_publishers": ("SELECT publisher_id FROM game_publishers WHERE appid = %s;", "DELETE FROM game_publishers WHERE appid = %s;"),
+}
+
+def internal_get_game_relation_ids(table, appid):
+    cur.execute(_game_relation_stmts[table][0], (appid,))
+    return [row[0] for row in cur]
+
+def internal_delete_game_relations(table, appid):
+    cur.execute(_game_relation_stmts[table][1], (appid,))
+
+_insert_game_genres_cursor = connection.cursor()
+
+_insert_game_genres_stmt = "INSERT IGNORE INTO game_genres "\
+    "(appid, genre_id) "\
+    "VALUES (%s, %s);"
+
+_insert_genre_cursor = connection.cursor()
+
+_insert_genre_stmt = "INSERT IGNORE INTO genres VALUES (%s, %s);"
+
+def internal_insert_game_genres(appid, genres):
+    known_genres = internal_get_dimension_cache("genres")
+    new_genres = [(genre["id"], genre["description"]) for genre in genres if int(genre["id"]) not in known_genres]
+    if len(new_genres) > 0:
+        _insert_genre_cursor.executemany(_insert_genre_stmt, new_genres)
+        for genre_id, description in new_genres:
+            known_genres[int(genre_id)] = description
+    if len(genres) > 0:
+        _insert_game_genres_cursor.executemany(_insert_game_genres_stmt, [(appid, genre["id"]) for genre in genres])
+
+_insert_game_categories_cursor = connection.cursor()
+
+_insert_game_categories_stmt = "INSERT IGNORE INTO game_categories "\
+    "(appid, category_id) "\
+    "VALUES (%s, %s);"
+
+_insert_category_cursor = connection.cursor()
 
-_get_publisher_id_cursor = connection.cursor(prepared=True)
+_insert_category_stmt = "INSERT IGNORE INTO categories VALUES (%s, %s);"
+
+def internal_insert_game_categories(appid, categories):
+    known_categories = internal_get_dimension_cache("categories")
+    new_categories = [(category["id"], category["description"]) for category in categories if int(category["id"]) not in known_categories]
+    if len(new_categories) > 0:
+        _insert_category_cursor.executemany(_insert_category_stmt, new_categories)
+        for category_id, description in new_categories:
+            known_categories[int(category_id)] = description
+    if len(categories) > 0:
+        _insert_game_categories_cursor.executemany(_insert_game_categories_stmt, [(appid, category["id"]) for category in categories])
+
+_get_or_create_name_cursor = connection.cursor(prepared=True)
+
+# LAST_INSERT_ID(id) makes lastrowid return the id of the existing row when the name is already there,
+# which also covers rows inserted by other crawlers after the cache was loaded
+_get_or_create_developer_stmt = "INSERT INTO developers (developer_name) VALUES (?) "\
+    "ON DUPLICATE KEY UPDATE developer_id = LAST_INSERT_ID(developer_id);"
+
+_get_or_create_publisher_stmt = "INSERT INTO publishers (publisher_name) VALUES (?) "\
+    "ON DUPLICATE KEY UPDATE publisher_id = LAST_INSERT_ID(publisher_id);"
+
+# every missing name is inserted in one statement, the ones that already exist are skipped, and all of their ids are read back in another one
+_insert_many_names_stmts = {
+    "developers": "INSERT IGNORE INTO developers (developer_name) VALUES {};",
+    "publishers": "INSERT IGNORE INTO publishers (publisher_name) VALUES {};",
+}
+
+_get_ids_from_names_stmts = {
+    "developers": "SELECT developer_name, developer_id FROM developers WHERE developer_name IN ({});",
+    "publishers": "SELECT publisher_name, publisher_id FROM publishers WHERE publisher_name IN ({});",
+}
+
+def _get_or_create_ids(table, stmt, names):
+    known_ids = internal_get_dimension_cache(table)
+    missing = [name for name in dict.fromkeys(names) if name not in known_ids]
+    for i in range(0, len(missing), _insert_many_chunk_size):
+        # no commit needed, the FK of the relation rows is checked inside this same transaction
+        chunk = missing[i:i + _insert_many_chunk_size]
+        cur.execute(_insert_many_names_stmts[table].format(", ".join(["(%s)"] * len(chunk))), chunk)
+        cur.execute(_get_ids_from_names_stmts[table].format(", ".join(["%s"] * len(chunk))), chunk)
+        for name, id in cur.fetchall():
+            known_ids[name] = id
+    for name in missing:
+        if name not in known_ids:
+            # the collation matched it to a name stored with other case or accents, the unique key gives its id
+            _get_or_create_name_cursor.execute(stmt, (name,))
+            known_ids[name] = _get_or_create_name_cursor.lastrowid
+    return [known_ids[name] for name in names]
+
+_insert_game_developers_cursor = connection.cursor()
+
+_insert_game_developers_stmt = "INSERT IGNORE INTO game_developers "\
+    "(appid, developer_id) "\
+    "VALUES (%s, %s);"
 
-_get_publisher_id_stmt = "SELECT publisher_id FROM publishers WHERE publisher_name = ?;"
+def internal_get_developer_ids(developers: list[str]):
+    return _get_or_create_ids("developers", _get_or_create_developer_stmt, developers)
 
-_insert_publisher_cursor = connection.cursor(prepared=True)
+def internal_insert_game_developers(appid, developers: list[str]):
+    developer_ids = internal_get_developer_ids(developers)
+    if len(developer_ids) > 0:
+        _insert_game_developers_cursor.executemany(_insert_game_developers_stmt, [(appid, developer_id) for developer_id in developer_ids])
 
-_insert_publisher_stmt = "INSERT INTO publishers (publisher_name) VALUES (?);"
+_insert_game_publishers_cursor = connection.cursor()
 
-_get_next_autoincrement_id_pub_cursor = connection.cursor(prepared=True)
+_insert_game_publishers_stmt = "INSERT IGNORE INTO game_publishers "\
+    "(appid, publisher_id) "\
+    "VALUES (%s, %s);"
 
-_get_next_autoincrement_id_pub_stmt = "SELECT AUTO_INCREMENT FROM information_schema.TABLES WHERE TABLE_SCHEMA = 'steam_tfg_jgg' AND TABLE_NAME = 'publishers';"
+def internal_get_publisher_ids(publishers: list[str]):
+    return _get_or_create_ids("publishers", _get_or_create_publisher_stmt, publishers)
 
 def internal_insert_game_publishers(appid, publishers: list[str]):
-    for publisher in publishers:
-        _get_publisher_id_cursor.execute(_get_publisher_id_stmt, (publisher,))
-        publisher_id = _get_publisher_id_cursor.fetchone()
-        if publisher_id is None:
-            _get_next_autoincrement_id_pub_cursor.execute(_get_next_autoincrement_id_pub_stmt)
-            publisher_id = _get_next_autoincrement_id_pub_cursor.fetchone()
-            _insert_publisher_cursor.execute(_insert_publisher_stmt, (publisher,))
-            connection.commit() # we need commit for the next row to not violate the foreign key constraint
-        publisher_id = publisher_id[0]
-        _insert_game_publishers_cursor.execute(_insert_game_publishers_stmt, (appid, publisher_id))
+    publisher_ids = internal_get_publisher_ids(publishers)
+    if len(publisher_ids) > 0:
+        _insert_game_publishers_cursor.executemany(_insert_game_publishers_stmt, [(appid, publisher_id) for publisher_id in publisher_ids])
 
 _insert_player_game_reviews_cursor = connection.cursor(prepared=True)
 
@@ -218,7 +429,15 @@ _insert_player_game_reviews_stmt = "INSERT INTO player_game_reviews "\
 
 def internal_insert_player_game_review(recommendationid, steamid, appid, voted_up, timestamp_created, timestamp_updated, playtime_at_review, playtime_forever,  received_for_free, steam_purchase, written_during_early_access, last_played):
     _insert_player_game_reviews_cursor.execute(_insert_player_game_reviews_stmt, (recommendationid, steamid, appid, voted_up, timestamp_created, timestamp_updated, playtime_at_review, received_for_free, steam_purchase, written_during_early_access))
-    internal_insert_player_game(steamid, appid, playtime_forever, None, None, None, None, last_played)
+    internal_insert_player_game(steamid, appid, playtime_forever, None, None, None, last_played)
+
+_insert_many_player_game_reviews_cursor = connection.cursor()
+
+_insert_many_player_game_reviews_stmt = _insert_player_game_reviews_stmt.replace("?", "%s")
+
+def internal_insert_player_game_reviews(rows):
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _insert_many_player_game_reviews_cursor.executemany(_insert_many_player_game_reviews_stmt, rows[i:i + _insert_many_chunk_size])
 
 _insert_player_games_cursor = connection.cursor(prepared=True)
 
@@ -236,6 +455,36 @@ def internal_insert_player_game(steamid, appid, playtime_forever, playtime_windo
     rtime_last_played = rtime_last_played if rtime_last_played > 0 else 1 # apparently MySQL's timestamps go from 1970-01-01 00:00:01 to 2038-01-19 03:14:07, 1970-01-01 00:00:00 isn't valid
     _insert_player_games_cursor.execute(_insert_player_games_stmt, (steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played))
 
+# executemany only rewrites the statement into a multi-row INSERT on non-prepared cursors, which use %s placeholders
+_insert_many_player_games_cursor = connection.cursor()
+
+_insert_many_player_games_stmt = "INSERT INTO player_games "\
+    "(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played) "\
+    "VALUES (%s, %s, %s, %s, %s, %s, FROM_UNIXTIME(%s)) ON DUPLICATE KEY UPDATE "\
+    "playtime_forever = VALUES(playtime_forever), "\
+    "playtime_windows = VALUES(playtime_windows), "\
+    "playtime_mac = VALUES(playtime_mac), "\
+    "playtime_linux = VALUES(playtime_linux), "\
+    "rtime_last_played = VALUES(rtime_last_played);"
+
+def internal_insert_player_games(rows):
+    rows = [(steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played if rtime_last_played > 0 else 1)
+            for steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, rtime_last_played in rows]
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _insert_many_player_games_cursor.executemany(_insert_many_player_games_stmt, rows[i:i + _insert_many_chunk_size])
+
+_get_player_games_cursor = connection.cursor()
+
+# rtime_last_played goes back to a unix timestamp, so rows can be compared with what GetOwnedGames returns
+_get_player_games_stmt = "SELECT steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, UNIX_TIMESTAMP(rtime_last_played) "\
+    "FROM player_games WHERE steamid IN ({});"
+
+def internal_get_player_games(steamids):
+    if len(steamids) == 0:
+        return []
+    _get_player_games_cursor.execute(_get_player_games_stmt.format(", ".join(["%s"] * len(steamids))), steamids)
+    return _get_player_games_cursor.fetchall()
+
 _insert_candidate_games_cursor = connection.cursor(prepared=True)
 
 _insert_candidate_games_stmt = "INSERT INTO candidate_appids (appid) VALUES (?) ON DUPLICATE KEY UPDATE count = count + 1;"
@@ -243,6 +492,16 @@ _insert_candidate_games_stmt = "INSERT INTO candidate_appids (appid) VALUES (?)
 def internal_insert_or_update_candidate_game(appid):
     _insert_candidate_games_cursor.execute(_insert_candidate_games_stmt, (appid,))
 
+_insert_many_candidate_games_cursor = connection.cursor()
+
+_insert_many_candidate_games_stmt = "INSERT INTO candidate_appids (appid, count) VALUES (%s, %s) ON DUPLICATE KEY UPDATE count = count + VALUES(count);"
+
+def internal_insert_or_update_candidate_games(counts):
+    # always locking the rows in appid order keeps workers flushing at the same time from deadlocking each other
+    rows = sorted(counts.items())
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _insert_many_candidate_games_cursor.executemany(_insert_many_candidate_games_stmt, rows[i:i + _insert_many_chunk_size])
+
 _insert_processed_appids_cursor = connection.cursor(prepared=True)
 
 _insert_processed_appids_stmt = "INSERT INTO processed_appids (appid) VALUES (?) ON DUPLICATE KEY UPDATE last_updated = CURRENT_TIMESTAMP;"
@@ -251,9 +510,29 @@ _delete_candidate_games_cursor = connection.cursor(prepared=True)
 
 _delete_candidate_games_stmt = "DELETE FROM candidate_appids WHERE appid = ?;"
 
+_review_cursor_cursor = connection.cursor(prepared=True)
+
+_get_review_cursor_stmt = "SELECT next_cursor FROM review_cursors WHERE appid = ?;"
+
+_update_review_cursor_stmt = "INSERT INTO review_cursors (appid, next_cursor) VALUES (?, ?) ON DUPLICATE KEY UPDATE next_cursor = VALUES(next_cursor);"
+
+_delete_review_cursor_stmt = "DELETE FROM review_cursors WHERE appid = ?;"
+
+def internal_get_review_cursor(appid):
+    _review_cursor_cursor.execute(_get_review_cursor_stmt, (appid,))
+    val = _review_cursor_cursor.fetchone()
+    return val[0] if val else None
+
+def internal_update_review_cursor(appid, next_cursor):
+    _review_cursor_cursor.execute(_update_review_cursor_stmt, (appid, next_cursor))
+
 def internal_insert_processed_appid(appid):
     _insert_processed_appids_cursor.execute(_insert_processed_appids_stmt, (appid,))
     _delete_candidate_games_cursor.execute(_delete_candidate_games_stmt, (appid,))
+    _review_cursor_cursor.execute(_delete_review_cursor_stmt, (appid,))
+
+def internal_delete_candidate_games(appids):
+    _delete_candidate_games_cursor.executemany(_delete_candidate_games_stmt, [(appid,) for appid in appids])
 
 _get_candidate_games_cursor = connection.cursor(prepared=True)
 
@@ -263,6 +542,70 @@ def internal_get_candidate_games(limit):
     candidates = _get_candidate_games_cursor.fetchall()
     return [candidate[0] for candidate in candidates]
 
+# Snapshot exports page through the big tables by primary key, so every chunk is an index range scan,
+# and only rows changed since the last snapshot are read when `since` is set
+_export_cursor = connection.cursor()
+
+_export_player_games_stmt = "SELECT steamid, appid, playtime_forever, playtime_windows, playtime_mac, playtime_linux, UNIX_TIMESTAMP(rtime_last_played) "\
+    "FROM player_games WHERE (steamid > %s OR (steamid = %s AND appid > %s)) AND date_retrieved >= %s "\
+    "ORDER BY steamid, appid LIMIT %s;"
+
+_export_player_game_reviews_stmt = "SELECT recommendationid, steamid, appid, voted_up + 0, UNIX_TIMESTAMP(timestamp_created), UNIX_TIMESTAMP(timestamp_updated), "\
+    "playtime_at_review, received_for_free + 0, steam_purchase + 0, written_during_early_access + 0 "\
+    "FROM player_game_reviews WHERE recommendationid > %s AND date_retrieved >= %s "\
+    "ORDER BY recommendationid LIMIT %s;"
+
+# databases created before the refreshes don't have the date_retrieved indexes their queries use, IF NOT EXISTS makes adding them idempotent
+_add_refresh_indexes_stmts = [
+    "CREATE INDEX IF NOT EXISTS `date_retrieved` ON game_details (`date_retrieved`);",
+    "CREATE INDEX IF NOT EXISTS `date_retrieved` ON player_data (`date_retrieved`);",
+]
+
+def internal_add_refresh_indexes():
+    for stmt in _add_refresh_indexes_stmts:
+        cur.execute(stmt)
+
+# databases created before the snapshot exports don't have date_retrieved in these tables, ADD COLUMN IF NOT EXISTS makes adding it idempotent
+_add_export_columns_stmts = [
+    "ALTER TABLE player_games ADD COLUMN IF NOT EXISTS `date_retrieved` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp() "\
+    "COMMENT 'Only changes when a value changes, used by incremental exports';",
+    "ALTER TABLE player_game_reviews ADD COLUMN IF NOT EXISTS `date_retrieved` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp() "\
+    "COMMENT 'Only changes when a value changes, used by incremental exports';",
+]
+
+def internal_add_export_columns():
+    for stmt in _add_export_columns_stmts:
+        cur.execute(stmt)
+
+def internal_export_player_games(after_steamid, after_appid, since, limit):
+    _export_cursor.execute(_export_player_games_stmt, (after_steamid, after_steamid, after_appid, since, limit))
+    return _export_cursor.fetchall()
+
+def internal_export_player_game_reviews(after_recommendationid, since, limit):
+    _export_cursor.execute(_export_player_game_reviews_stmt, (after_recommendationid, since, limit))
+    return _export_cursor.fetchall()
+
+# only players whose games were crawled, review authors that weren't have a single game taken from their review
+_export_crawled_player_games_stmt = "SELECT player_games.steamid, player_games.appid, player_games.playtime_forever FROM player_games "\
+    "JOIN player_data ON player_data.steamid = player_games.steamid "\
+    "WHERE (player_games.steamid > %s OR (player_games.steamid = %s AND player_games.appid > %s)) AND player_data.visibility >= 2 "\
+    "ORDER BY player_games.steamid, player_games.appid LIMIT %s;"
+
+def internal_export_crawled_player_games(after_steamid, after_appid, limit):
+    _export_cursor.execute(_export_crawled_player_games_stmt, (after_steamid, after_steamid, after_appid, limit))
+    return _export_cursor.fetchall()
+
+_get_players_retrieved_since_stmt = "SELECT steamid FROM player_data "\
+    "WHERE visibility >= 2 AND date_retrieved >= %s AND steamid > %s ORDER BY steamid LIMIT %s;"
+
+def internal_get_players_retrieved_since(since, after_steamid, limit):
+    _export_cursor.execute(_get_players_retrieved_since_stmt, (since, after_steamid, limit))
+    return [row[0] for row in _export_cursor.fetchall()]
+
+def internal_get_database_time():
+    cur.execute("SELECT NOW();")
+    return cur.fetchone()[0]
+
 _get_game_data_cursor = connection.cursor(prepared=True)
 
 _get_game_data_stmt = "SELECT * FROM game_details WHERE appid = ?;"
@@ -271,6 +614,12 @@ def internal_get_game_data(appid):
     _get_game_data_cursor.execute(_get_game_data_stmt, (appid,))
     return _get_game_data_cursor.fetchone()
 
+_get_all_appids_stmt = "SELECT appid FROM game_details;"
+
+def internal_get_all_appids():
+    cur.execute(_get_all_appids_stmt)
+    return [row[0] for row in cur]
+
 _get_game_data_from_name_stmt = "SELECT * FROM game_details WHERE name = ?;"
 
 def internal_get_game_data_from_name(name):
@@ -283,22 +632,52 @@ _insert_tag_stmt = "INSERT INTO tags (tagid, name) VALUES (?, ?);"
 
 def internal_insert_tag(tagid, name):
     _insert_tag_cursor.execute(_insert_tag_stmt, (tagid, name))
+    internal_get_dimension_cache("tags").setdefault(name, tagid)
 
 _insert_new_tag_stmt = "INSERT INTO tags (name) VALUES (?);"
 
 def internal_insert_new_tag(name):
     _insert_tag_cursor.execute(_insert_new_tag_stmt, (name,))
-    return _insert_tag_cursor.lastrowid
+    tagid = _insert_tag_cursor.lastrowid
+    internal_get_dimension_cache("tags").setdefault(name, tagid)
+    return tagid
 
 _get_tagid_from_name = connection.cursor(prepared=True)
 
 _get_tagid_from_name_stmt = "SELECT tagid FROM tags WHERE name = ?;"
 
 def internal_get_tagid_from_name(name):
+    known_tags = internal_get_dimension_cache("tags")
+    if name in known_tags:
+        return known_tags[name]
+    # it might have been inserted by another process
     _get_tagid_from_name.execute(_get_tagid_from_name_stmt, (name,))
     val = _get_tagid_from_name.fetchone()
+    if val:
+        known_tags[name] = val[0]
     return val[0] if val else None
 
+_get_tagids_from_names_stmt = "SELECT name, tagid FROM tags WHERE name IN ({}) ORDER BY tagid DESC;"
+
+def internal_get_tagids_from_names(names):
+    """Resolves many tag names at once, inserting the ones that don't exist yet.
+
+    Returns:
+        dict: name -> tagid
+    """
+    known_tags = internal_get_dimension_cache("tags")
+    missing = [name for name in set(names) if name not in known_tags]
+    for i in range(0, len(missing), _insert_many_chunk_size):
+        # they might have been inserted by another process
+        chunk = missing[i:i + _insert_many_chunk_size]
+        cur.execute(_get_tagids_from_names_stmt.format(", ".join(["%s"] * len(chunk))), chunk)
+        for name, tagid in cur.fetchall():
+            known_tags[name] = tagid
+    for name in missing:
+        if name not in known_tags:
+            internal_insert_new_tag(name)
+    return {name: known_tags[name] for name in names}
+
 _insert_delete_game_tag_cursor = connection.cursor(prepared=True)
 
 _insert_game_tag_stmt = "INSERT INTO game_tags (appid, tagid, priority) VALUES (?, ?, ?);"
@@ -313,4 +692,64 @@ def internal_insert_game_tag(appid, tagid, priority, ignore=False):
 _delete_game_tag_stmt = "DELETE FROM game_tags WHERE appid = ?;"
 
 def internal_delete_old_game_tags(appid):
-    _insert_delete_game_tag_cursor.execute(_delete_game_tag_stmt, (appid,))
\ No newline at end of file
+    _insert_delete_game_tag_cursor.execute(_delete_game_tag_stmt, (appid,))
+
+_insert_many_game_tags_cursor = connection.cursor()
+
+_insert_many_game_tags_stmt = "INSERT INTO game_tags (appid, tagid, priority) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE priority = VALUES(priority);"
+
+def internal_insert_game_tags(rows):
+    for i in range(0, len(rows), _insert_many_chunk_size):
+        _insert_many_game_tags_cursor.executemany(_insert_many_game_tags_stmt, rows[i:i + _insert_many_chunk_size])
+
+def internal_delete_game_tags(appids):
+    for i in range(0, len(appids), _insert_many_chunk_size):
+        chunk = appids[i:i + _insert_many_chunk_size]
+        _insert_many_game_tags_cursor.execute("DELETE FROM game_tags WHERE appid IN (" + ", ".join(["%s"] * len(chunk)) + ");", chunk)
+
+def internal_touch_game_tags(appids):
+    for i in range(0, len(appids), _insert_many_chunk_size):
+        chunk = appids[i:i + _insert_many_chunk_size]
+        _insert_many_game_tags_cursor.execute("UPDATE game_details SET tags_retrieved = CURRENT_TIMESTAMP WHERE appid IN (" + ", ".join(["%s"] * len(chunk)) + ");", chunk)
+
+# databases created before the tag refreshes don't have tags_retrieved, ADD ... IF NOT EXISTS makes adding it idempotent
+_add_tags_retrieved_stmt = "ALTER TABLE game_details "\
+    "ADD COLUMN IF NOT EXISTS `tags_retrieved` datetime DEFAULT NULL COMMENT 'Last time the tags of the game were scraped, NULL if they never were', "\
+    "ADD KEY IF NOT EXISTS `tags_retrieved` (`tags_retrieved`);"
+
+def internal_add_tags_retrieved_column():
+    cur.execute(_add_tags_retrieved_stmt)
+
+# apps whose tags were never scraped or were scraped more than N days ago, read in appid order with a connection of their own
+_get_apps_without_fresh_tags_stmt = "SELECT appid FROM game_details "\
+    "WHERE appid > %s AND name NOT IN ('DEAD_HIDDEN_GAME', 'FAULTY_GAME') "\
+    "AND (tags_retrieved IS NULL OR tags_retrieved < NOW() - INTERVAL %s DAY) "\
+    "ORDER BY appid LIMIT %s;"
+
+def internal_get_apps_without_fresh_tags(own_connection, after_appid, max_age_days, limit):
+    own_cursor = own_connection.cursor()
+    try:
+        own_cursor.execute(_get_apps_without_fresh_tags_stmt, (after_appid, max_age_days, limit))
+        return [row[0] for row in own_cursor.fetchall()]
+    finally:
+        own_cursor.close()
+        # ends the read snapshot, otherwise the next chunks wouldn't see the tags written meanwhile
+        own_connection.commit()
+
+_get_queue_depth_stmt = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'player_crawl_queue';"
+
+def internal_get_queue_depth():
+    # InnoDB's estimate, COUNT(*) would scan the whole queue on every batch
+    cur.execute(_get_queue_depth_stmt)
+    row = cur.fetchone()
+    return row[0] if row is not None and row[0] is not None else 0
+
+def internal_get_statement_count():
+    # statements sent by this connection so far, this one included
+    cur.execute("SHOW SESSION STATUS LIKE 'Questions';")
+    return int(cur.fetchone()[1])
+
+# every internal_* function and every commit records its time in the db_statement_seconds histogram, except the ones made inside another
+# of them. internal_connect opens connections instead of running statements
+metrics.instrument_functions(globals(), "internal_", "db_statement_seconds", exclude=("internal_connect",))
+connection.commit = metrics.timed_function(connection.commit, "db_statement_seconds", outermost=True, function="commit")
@@ -6,3 +6,10 @@ class RequiresManualIntervention(Exception):
         self.name = name
         self.message = message
         super().__init__(self.message)
+
+class ReviewsUnavailable(Exception):
+    def __init__(self, appid, cursor: str, message: str=""):
+        self.appid = appid
+        self.cursor = cursor
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,166 @@
+"""
+This script exports player_games and player_game_reviews to Parquet files, so they can be analyzed without querying the crawler's database.
+Tables are read in primary key order, one chunk at a time, and written with the smallest types that fit every column.
+Each run writes a new snapshot partition. Runs after the first only export the rows that changed since the previous snapshot.
+
+Output layout: <output_dir>/<table>/snapshot=<YYYYmmddTHHMMSS>/part-<n>.parquet
+"""
+
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import *
+
+_state_filename = "snapshot_state.json"
+
+# rows earlier than this are before any possible date_retrieved, so a snapshot since this date is a full export
+_full_export_since = "1970-01-01 00:00:01"
+
+_player_games_schema = pa.schema([
+    ("steamid", pa.uint64()),
+    ("appid", pa.uint32()),
+    ("playtime_forever", pa.int32()),
+    ("playtime_windows", pa.int32()),
+    ("playtime_mac", pa.int32()),
+    ("playtime_linux", pa.int32()),
+    ("rtime_last_played", pa.timestamp("s")),
+])
+
+_player_game_reviews_schema = pa.schema([
+    ("recommendationid", pa.uint32()),
+    ("steamid", pa.uint64()),
+    ("appid", pa.uint32()),
+    ("voted_up", pa.bool_()),
+    ("timestamp_created", pa.timestamp("s")),
+    ("timestamp_updated", pa.timestamp("s")),
+    ("playtime_at_review", pa.int32()),
+    ("received_for_free", pa.bool_()),
+    ("steam_purchase", pa.bool_()),
+    ("written_during_early_access", pa.bool_()),
+])
+
+def _to_table(rows, schema: pa.Schema) -> pa.Table:
+    columns = list(zip(*rows))
+    arrays = []
+    for column, field in zip(columns, schema):
+        if pa.types.is_boolean(field.type):
+            column = [None if value is None else bool(value) for value in column]
+        arrays.append(pa.array(column, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+class _PartitionWriter:
+    """Writes chunks of rows to part files of a snapshot partition, starting a new file every `rows_per_file` rows."""
+
+    def __init__(self, directory: str, schema: pa.Schema, rows_per_file: int):
+        self.directory = directory
+        self.schema = schema
+        self.rows_per_file = rows_per_file
+        self.num_files = 0
+        self.num_rows = 0
+        self._writer = None
+        self._rows_in_file = 0
+
+    def write(self, rows):
+        if self._writer is None or self._rows_in_file >= self.rows_per_file:
+            self.close()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"part-{self.num_files:05d}.parquet")
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+            self.num_files += 1
+            self._rows_in_file = 0
+        # every chunk becomes a row group
+        self._writer.write_table(_to_table(rows, self.schema))
+        self._rows_in_file += len(rows)
+        self.num_rows += len(rows)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def export_player_games_snapshot(directory, since, chunk_size, rows_per_file, verbose=False):
+    writer = _PartitionWriter(directory, _player_games_schema, rows_per_file)
+    try:
+        after_steamid, after_appid = 0, 0
+        rows = export_player_games(after_steamid, after_appid, since, chunk_size)
+        while len(rows) > 0:
+            writer.write(rows)
+            after_steamid, after_appid = rows[-1][0], rows[-1][1]
+            if verbose:
+                print(f"player_games: {writer.num_rows} rows exported (last steamid: {after_steamid})")
+            rows = export_player_games(after_steamid, after_appid, since, chunk_size)
+    finally:
+        writer.close()
+    return writer.num_rows
+
+def export_player_game_reviews_snapshot(directory, since, chunk_size, rows_per_file, verbose=False):
+    writer = _PartitionWriter(directory, _player_game_reviews_schema, rows_per_file)
+    try:
+        after_recommendationid = 0
+        rows = export_player_game_reviews(after_recommendationid, since, chunk_size)
+        while len(rows) > 0:
+            writer.write(rows)
+            after_recommendationid = rows[-1][0]
+            if verbose:
+                print(f"player_game_reviews: {writer.num_rows} rows exported (last recommendationid: {after_recommendationid})")
+            rows = export_player_game_reviews(after_recommendationid, since, chunk_size)
+    finally:
+        writer.close()
+    return writer.num_rows
+
+_exporters = {
+    "player_games": export_player_games_snapshot,
+    "player_game_reviews": export_player_game_reviews_snapshot,
+}
+
+def export_snapshot(output_dir, full=False, chunk_size=100000, rows_per_file=5000000, verbose=False):
+    """Exports every table to a new snapshot partition of `output_dir`.
+
+    The database time at the start of the export is saved in snapshot_state.json, and the next run only exports
+    rows changed from that moment on. Rows changed while an export runs may show up in two snapshots, never in none.
+
+    Returns:
+        dict: table -> number of rows exported
+    """
+    state_path = os.path.join(output_dir, _state_filename)
+    state = dict()
+    if not full and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    snapshot_time = get_database_time()
+    partition = "snapshot=" + snapshot_time.strftime("%Y%m%dT%H%M%S")
+    num_rows = dict()
+    for table, exporter in _exporters.items():
+        since = state.get(table, _full_export_since)
+        print(f"Exporting {table} rows changed since {since}...")
+        num_rows[table] = exporter(os.path.join(output_dir, table, partition), since, chunk_size, rows_per_file, verbose)
+        print(f"{num_rows[table]} {table} rows exported")
+        # the state is saved after every table, so an interrupted export doesn't repeat the tables that finished
+        state[table] = snapshot_time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+    return num_rows
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export player_games and player_game_reviews to Parquet snapshots.")
+    parser.add_argument("output_dir", help="Directory of the snapshots.")
+    parser.add_argument("--full", action="store_true", help="Export every row instead of the ones changed since the last snapshot.")
+    parser.add_argument("-c", "--chunk_size", type=int, default=100000, help="Rows read per query.")
+    parser.add_argument("-f", "--rows_per_file", type=int, default=5000000, help="Rows per Parquet file.")
+    parser.add_argument("--migrate", action="store_true", help="Add the date_retrieved columns to a database created before the snapshot exports.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.migrate:
+        print("Adding date_retrieved to player_games and player_game_reviews...")
+        add_export_columns()
+    try:
+        start_time = time.time()
+        export_snapshot(args.output_dir, args.full, args.chunk_size, args.rows_per_file, args.verbose)
+        print("Done!")
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected. Exiting...")
+    finally:
+        print("Total time:", time.time() - start_time, "seconds")
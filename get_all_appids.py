@@ -1,40 +1,132 @@
 """
-This script crawls game data for a single game.
+This script keeps the catalog of every appid on Steam up to date.
 Author: Jorge González
 Date: 2023-02-10
+
+IStoreService/GetAppList is paginated and accepts if_modified_since, so after the first run only the apps changed since the previous sync are downloaded.
+
+Files:
+    appids_known.bin: every appid seen so far (see AppidBitmap)
+    appids_sync.json: the time of the last sync
+    appids_new.txt: the appids that are new since the previous sync, one per line
+    appids_removed.txt: the appids that disappeared from the catalog, only written by full syncs
+    appids.txt: every known appid, one per line
 """
 
-from steam import Steam
-from decouple import config, UndefinedValueError
-from requests import request, Response
 import json
+import os
+import time
+import transport
+from appid_index import AppidBitmap
+from config import get_api_key, report_api_key_status
+
+_known_appids_path = "appids_known.bin"
+_sync_state_path = "appids_sync.json"
+
+# the maximum page size GetAppList allows
+_page_size = 50000
+
+def download_app_list_pages(if_modified_since=None):
+    """Downloads GetAppList one page at a time, so only one page is in memory at once.
+
+    Args:
+        if_modified_since (int, optional): unix time, only apps changed after it are returned. Defaults to every app.
+
+    Yields:
+        list[dict]: the apps of every page ({"appid", "name", "last_modified", "price_change_number"})
+    """
+    params = {
+        "include_games": True,
+        "include_dlc": True,
+        "include_software": True,
+        "include_videos": True,
+        "include_hardware": True,
+        "max_results": _page_size,
+        "last_appid": 0,
+    }
+    if if_modified_since is not None:
+        params["if_modified_since"] = if_modified_since
+    consecutive_retries = 0
+    while True:
+        try:
+            key = get_api_key("GetAppList")
+            response = transport.get(transport.API_URL + "/IStoreService/GetAppList/v1/", params={**params, "key": key})
+            report_api_key_status(key, response.status_code)
+        except Exception as e:
+            print("Exception while requesting the app list: " + str(e) + "\n")
+            consecutive_retries = min(consecutive_retries + 1, 3 * 5)
+            print(f"Waiting {(consecutive_retries * 20.0 / 60.0)} minute(s) before retrying...")
+            time.sleep(consecutive_retries * 20.0)
+            continue
+        if response.status_code != 200:
+            print(f"REST API error ({response.status_code}) while requesting the app list: " + str(response.text))
+            consecutive_retries = min(consecutive_retries + 1, 3)
+            print(f"Waiting {((30.0 + consecutive_retries * 30.0) / 60.0)} minute(s) before retrying...")
+            time.sleep(30.0 + consecutive_retries * 30.0)
+            continue
+        consecutive_retries = 0
+        page = json.loads(response.text)["response"]
+        yield page.get("apps", [])
+        if not page.get("have_more_results", False):
+            return
+        params["last_appid"] = page["last_appid"]
+
+def _write_appids(path, appids, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for appid in appids:
+            f.write(str(appid) + "\n")
+
+def get_all_appids(full=False):
+    """Syncs the catalog, writing the appids that are new since the previous sync to appids_new.txt.
+
+    Args:
+        full (bool): download the whole catalog instead of the changes, which also finds the removed apps
+
+    Returns:
+        Tuple[list, list]: the new appids and the removed ones (always empty unless full)
+    """
+    known_appids = AppidBitmap.load(_known_appids_path) if os.path.exists(_known_appids_path) else AppidBitmap()
+    if_modified_since = None
+    if not full and len(known_appids) > 0 and os.path.exists(_sync_state_path):
+        with open(_sync_state_path, "r", encoding="utf-8") as f:
+            if_modified_since = json.load(f)["last_sync"]
+    full = if_modified_since is None
+    sync_start = int(time.time())
+
+    new_appids = []
+    seen_appids = AppidBitmap()
+    num_apps = 0
+    for apps in download_app_list_pages(if_modified_since):
+        for app in apps:
+            appid = app["appid"]
+            seen_appids.add(appid)
+            if appid not in known_appids:
+                known_appids.add(appid)
+                new_appids.append(appid)
+        num_apps += len(apps)
+        print(f"{num_apps} apps downloaded, {len(new_appids)} new")
+    removed_appids = [appid for appid in known_appids if appid not in seen_appids] if full else []
 
-try:
-    KEY = config("STEAM_API_KEY")
-except UnicodeDecodeError as e:
-    print("Ensure your .env/settings.ini file is encoded in UTF-8.")
-    exit(-1)
-except UndefinedValueError as e:
-    print(e)
-    print("Tips:\r\n- You can create an .env file with 'STEAM_API_KEY=\"YOUR_API_KEY\"'.")
-    print("- You can also define an environment variable STEAM_API_KEY with your API key.")
-    exit(-1)
-
-steam = Steam(KEY)
-
-def get_all_appids():
-    response = request("get", "https://api.steampowered.com/ISteamApps/GetAppList/v2/")
-    print("Response code: " + str(response.status_code))
-    if response.status_code == 200:
-        # dump raw data, useful to manually check which game is which visually
-        with open("appids_raw.json", "w", encoding="utf-8") as f:
-            f.write(response.text)
-        # dump appids
-        with open("appids.txt", "w", encoding="utf-8") as f:
-            for appdata in response.json()["applist"]["apps"]:
-                f.write(str(appdata["appid"]) + "\n")
+    _write_appids("appids_new.txt", new_appids)
+    if full:
+        _write_appids("appids_removed.txt", removed_appids)
+        # the whole catalog was downloaded, appids.txt is written from scratch with what's in it now
+        _write_appids("appids.txt", seen_appids)
+        known_appids = seen_appids
     else:
-        print("Error: " + str(response.text))
+        _write_appids("appids.txt", new_appids, mode="a")
+    known_appids.save(_known_appids_path)
+    # saved last, a sync that crashes gets repeated from the same point
+    with open(_sync_state_path, "w", encoding="utf-8") as f:
+        json.dump({"last_sync": sync_start}, f)
+    return new_appids, removed_appids
 
 if __name__ == "__main__":
-    get_all_appids()
+    import argparse
+    parser = argparse.ArgumentParser(description="Sync the catalog of every appid on Steam.")
+    parser.add_argument("--full", action="store_true", help="Download the whole catalog, finding the removed apps too.")
+    args = parser.parse_args()
+    new_appids, removed_appids = get_all_appids(args.full)
+    print(f"{len(new_appids)} new apps written to appids_new.txt")
+    if args.full:
+        print(f"{len(removed_appids)} removed apps written to appids_removed.txt")
@@ -1,12 +1,12 @@
-from requests import get
 import json
+import transport
 from database import *
 
 lang = "english"  # future work: language is shared through config.py
-popular_tags_url = "https://store.steampowered.com/tagdata/populartags/" + lang
+popular_tags_url = transport.STORE_URL + "/tagdata/populartags/" + lang
 
 def get_popular_tags():
-    response = get(popular_tags_url)
+    response = transport.get(popular_tags_url)
     if response.status_code == 200:
         return json.loads(response.text)
     else:
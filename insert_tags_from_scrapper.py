@@ -2,67 +2,120 @@ import pandas as pd
 from database import *
 from exceptions import *
 
+# apps whose tags are replaced per transaction
+_chunk_size = 1000
+
 def check_duplicate_appids(df_gametags: pd.DataFrame):
     # check for duplicate appids
-    appdict = dict()
-    max_len = 1
-    for idx, row in df_gametags.iterrows():
-        if row['appid'] == 'app': # error
-            continue
-        if row['appid'] in appdict:
-            current = (row['name'], row['tags'])
-            if current != appdict[row['appid']]:
-                print("Error: duplicate appid with different values found: " + row['appid'])
-                print("Current: " + str(current))
-                print("Previous: " + str(appdict[row['appid']]))
-                max_len = 0
-        else:
-            appdict[row['appid']] = (row['name'], row['tags'])
-            if max_len > 0:
-                max_len = max(max_len, len(row['tags']))
-    return max_len
+    df_gametags = df_gametags[df_gametags['appid'] != 'app'] # error
+    games = pd.DataFrame({
+        'appid': df_gametags['appid'],
+        'name': df_gametags['name'],
+        'tags': df_gametags['tags'].map(tuple), # lists can't be hashed
+    }).drop_duplicates()
+    duplicates = games[games['appid'].duplicated(keep=False)]
+    if len(duplicates) > 0:
+        for appid, rows in duplicates.groupby('appid', sort=False):
+            print("Error: duplicate appid with different values found: " + str(appid))
+            for name, tags in zip(rows['name'], rows['tags']):
+                print("Values: " + str((name, list(tags))))
+        return 0
+    return max(1, int(df_gametags['tags'].map(len).max())) if len(df_gametags) > 0 else 1
+
+def _resolve_missing_appids(tags: pd.DataFrame):
+    """Maps the appids that aren't in the database to the appid of the game with the same name.
 
-def insert_tags_from_scrapper(filename):
+    Returns:
+        Tuple[pd.Series, list]: the resolved appid of every row (NaN if there's none) and the RequiresManualIntervention errors
+    """
+    requires_manual_intervention = []
+    appids = tags.index.to_series(index=tags.index).astype('float64')
+    missing = ~appids.map(game_exists)
+    for appid, name in tags.loc[missing, 'name'].items():
+        # first try to get the appid, since it might come from a redirect, like Total War: Shogun 2
+        try:
+            print("Game with appid not inside the database (redirects, betas, etc.): " + name + " (" + str(appid) + ")")
+            gdata = get_game_data_from_name(name)
+            if gdata is None:
+                raise RequiresManualIntervention([], name, "No appid found for game " + name)
+            appids[appid] = int(gdata[0])
+        except RequiresManualIntervention as e:
+            print("Unambiguous appid returned for game with appid not inside the database (redirects, betas, etc.): " + e.name + " (" + str(e.appids) + ")")
+            requires_manual_intervention.append(e)
+            appids[appid] = float('nan')
+    return appids, requires_manual_intervention
+
+def insert_tags_from_scrapper(filename, max_len=None):
     try:
         tags = pd.read_json(filename, lines=True)
-        tags = tags.drop_duplicates(subset='appid', keep='first').set_index('appid')
     except FileNotFoundError:
         print(filename + " not found.")
         return
     except ValueError:
         print("Error: " + filename + " is not a valid JSON Lines file.")
         return
-    
-    requires_manual_intervention = []
-    for appid, row in tags.iterrows():
-        if appid == 'app' or row is None: # error
-            continue
+    if max_len is None:
+        max_len = check_duplicate_appids(tags)
+    insert_tags_from_dataframe(tags, max_len)
+
+def insert_tags_from_dataframe(tags: pd.DataFrame, max_len: int, verbose=True):
+    """Replaces the tags of every game in a DataFrame with the appid, name and tags columns of the scraper items.
+    Items with a requested_appid column also get the tags_retrieved of the appid that was requested stamped, when the store redirected it to another one.
+
+    Returns:
+        list: the RequiresManualIntervention errors of the games that couldn't be found in the database
+    """
+    # JSON Lines files of older crawls don't have requested_appid
+    requested_appids = tags['requested_appid'].dropna().astype('int64').unique().tolist() if 'requested_appid' in tags.columns else []
+    tags = tags[tags['appid'] != 'app'].dropna(subset=['appid']) # error
+    tags = tags.astype({'appid': 'int64'}).drop_duplicates(subset='appid', keep='first').set_index('appid')
+
+    appids, requires_manual_intervention = _resolve_missing_appids(tags)
+    tags = tags.assign(resolved_appid=appids).dropna(subset=['resolved_appid'])
+    # two scraped apps can redirect to the same game, the first one wins like it did when they were inserted one by one
+    tags = tags.drop_duplicates(subset='resolved_appid', keep='first')
+
+    # one row per (game, tag), the position of a tag in its list is its priority
+    game_tags = tags[['resolved_appid', 'tags']].explode('tags').dropna(subset=['tags'])
+    game_tags['position'] = game_tags.groupby('resolved_appid', sort=False).cumcount()
+    tagids = get_tagids(game_tags['tags'].unique().tolist())
+    game_tags = pd.DataFrame({
+        'appid': game_tags['resolved_appid'].astype('int64'),
+        'tagid': game_tags['tags'].map(tagids).astype('int64'),
+        'priority': (max_len - game_tags['position']) / max_len,
+    }).drop_duplicates(subset=['appid', 'tagid'], keep='first')
 
-        if not game_exists(appid):
-            # first try to get the appid, since it might come from a redirect, like Total War: Shogun 2
-            try:
-                print("Game with appid not inside the database (redirects, betas, etc.): " + row['name'] + " (" + str(appid) + ")")
-                gdata = get_game_data_from_name(row['name'])
-                if gdata is None:
-                    raise RequiresManualIntervention([], row['name'], "No appid found for game " + row['name'])
-                appid = int(gdata[0])
-            except RequiresManualIntervention as e:
-                print("Unambiguous appid returned for game with appid not inside the database (redirects, betas, etc.): " + e.name + " (" + str(e.appids) + ")")
-                requires_manual_intervention += (e.name, e.appids)
-                continue
+    all_appids = tags['resolved_appid'].astype('int64').tolist()
+    chunk_numbers = game_tags['appid'].map(pd.Series(range(len(all_appids)), index=all_appids)) // _chunk_size
+    chunks = {chunk_number: chunk for chunk_number, chunk in game_tags.groupby(chunk_numbers)}
+    for chunk_number, i in enumerate(range(0, len(all_appids), _chunk_size)):
+        # games without tags are in the chunk too, so their old tags get deleted
+        chunk = chunks.get(chunk_number, game_tags.iloc[0:0])
+        # the connector can't convert numpy scalars
+        rows = [(int(appid), int(tagid), float(priority)) for appid, tagid, priority in chunk.itertuples(index=False, name=None)]
+        replace_game_tags(all_appids[i:i + _chunk_size], rows)
+        if verbose:
+            print(f"Tags of {min(i + _chunk_size, len(all_appids))}/{len(all_appids)} games inserted")
+    # otherwise every tag refresh would request the apps that redirect again
+    touch_game_tags(requested_appids)
 
-        insert_game_tags(appid, row['tags'], max_len)
-    
     if len(requires_manual_intervention) > 0:
         print("Manual intervention required for the following games:")
         for game in requires_manual_intervention:
             print(game.name + ": " + str(game.appids))
+    return requires_manual_intervention
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("filename", help="Filename of the JSON Lines file to be inserted")
+    parser.add_argument("filename", nargs="?", default=None, help="Filename of the JSON Lines file to be inserted")
+    parser.add_argument("--migrate", action="store_true", help="Add the tags_retrieved column to a database created before the tag refreshes.")
     args = parser.parse_args()
+    if args.migrate:
+        print("Adding tags_retrieved to game_details...")
+        add_tags_retrieved_column()
+    if args.filename is None:
+        exit(0)
     df_gametags = pd.read_json(args.filename, lines=True)
     if (max_len := check_duplicate_appids(df_gametags)) > 0:
         print("Inserting tags from " + args.filename + "...")
@@ -0,0 +1,95 @@
+"""
+Pool of Steam Web API keys. Every key has its own rate limit buckets and daily quota,
+and keys that start getting 403/429 responses are benched for a while.
+"""
+
+import asyncio
+import hashlib
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import metrics
+from rate_limiter import RateLimiter
+
+# 429 means we went over the key's limits, the bench doubles on every consecutive one
+_too_many_requests_bench = 60
+_max_bench = 60 * 60
+# 403 usually means the key was revoked or has used its quota, so it's benched for the maximum time at once
+_forbidden_bench = _max_bench
+
+
+def get_key_id(key: str) -> str:
+    # keys are never written to the rate limits file, only a short hash of them
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+
+
+class KeyPool:
+    def __init__(self, keys: List[str], rate_limiter: RateLimiter):
+        if len(keys) == 0:
+            raise ValueError("The key pool needs at least one API key")
+        self.keys = list(keys)
+        self.rate_limiter = rate_limiter
+        self._key_ids = {key: get_key_id(key) for key in self.keys}
+        self._benched_until = {key: 0.0 for key in self.keys}
+        self._strikes = {key: 0 for key in self.keys}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, endpoint: str) -> Tuple[Optional[str], float]:
+        # round robin over the healthy keys, the first one with a token left in its bucket wins
+        now = time.time()
+        min_wait_time = None
+        with self._lock:
+            first_key = self._next_key
+            self._next_key = (self._next_key + 1) % len(self.keys)
+        for i in range(len(self.keys)):
+            key = self.keys[(first_key + i) % len(self.keys)]
+            if self._benched_until[key] > now:
+                wait_time = self._benched_until[key] - now
+            else:
+                _, wait_time = self.rate_limiter.reserve(endpoint, self._key_ids[key])
+                if wait_time == 0:
+                    return key, 0.0
+            min_wait_time = wait_time if min_wait_time is None else min(min_wait_time, wait_time)
+        return None, min_wait_time
+
+    def get_key(self, endpoint: str) -> str:
+        """Returns a healthy key with budget left for the endpoint, waiting until there's one."""
+        key, wait_time = self._reserve(endpoint)
+        while key is None:
+            print(f"Waiting {wait_time} seconds for an API key with {endpoint} budget...")
+            metrics.inc("rate_limit_wait_seconds_total", wait_time, endpoint=endpoint)
+            time.sleep(wait_time)
+            key, wait_time = self._reserve(endpoint)
+        return key
+
+    async def async_get_key(self, endpoint: str) -> str:
+        # reserving can wait up to a minute on the SQLite lock of other workers, the event loop keeps running meanwhile
+        key, wait_time = await asyncio.to_thread(self._reserve, endpoint)
+        while key is None:
+            print(f"Waiting {wait_time} seconds for an API key with {endpoint} budget...")
+            metrics.inc("rate_limit_wait_seconds_total", wait_time, endpoint=endpoint)
+            await asyncio.sleep(wait_time)
+            key, wait_time = await asyncio.to_thread(self._reserve, endpoint)
+        return key
+
+    def report(self, key: str, status_code: int):
+        """Updates the health of a key with the status code of a response made with it."""
+        with self._lock:
+            if status_code == 429:
+                self._strikes[key] += 1
+                bench = min(_too_many_requests_bench * 2 ** (self._strikes[key] - 1), _max_bench)
+            elif status_code == 403:
+                self._strikes[key] += 1
+                bench = _forbidden_bench
+            else:
+                self._strikes[key] = 0
+                return
+            self._benched_until[key] = time.time() + bench
+        metrics.inc("api_key_benched_total", status=str(status_code))
+        print(f"API key {self._key_ids[key]} got a {status_code} response, benched for {bench} seconds.")
+
+    def get_healthy_keys(self) -> List[str]:
+        now = time.time()
+        return [key for key in self.keys if self._benched_until[key] <= now]
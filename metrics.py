@@ -0,0 +1,158 @@
+"""
+In-process metrics of the crawlers: counters, gauges and latency histograms, with labels.
+They can be scraped in the Prometheus text format from a local HTTP endpoint, and printed as periodic JSON log lines.
+Recording a value only takes a lock and a dict update, so instrumented code doesn't need to check if metrics are enabled.
+"""
+
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Tuple
+
+# upper bounds in seconds, from a fast indexed query to a request that waited for a retry
+_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = dict()
+_gauges: Dict[Tuple[str, tuple], float] = dict()
+# (name, labels) -> [count per bucket, sum, count]
+_histograms: Dict[Tuple[str, tuple], list] = dict()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(_buckets), 0.0, 0]
+        for i, upper_bound in enumerate(_buckets):
+            if value <= upper_bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observes the time spent inside the with block in the `name` histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+# names of the histograms with an outermost timed call running, per thread
+_outermost_calls = threading.local()
+
+def timed_function(wrapped: Callable, name: str, outermost: bool = False, **labels) -> Callable:
+    """Returns a version of `wrapped` that observes its time in the `name` histogram.
+    With outermost, calls made while another outermost call of the same histogram runs in the thread aren't observed, so their time isn't counted twice."""
+    if not outermost:
+        @functools.wraps(wrapped)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return wrapped(*args, **kwargs)
+        return wrapper
+
+    @functools.wraps(wrapped)
+    def outermost_wrapper(*args, **kwargs):
+        running = _outermost_calls.__dict__.setdefault("names", set())
+        if name in running:
+            return wrapped(*args, **kwargs)
+        running.add(name)
+        try:
+            with timed(name, **labels):
+                return wrapped(*args, **kwargs)
+        finally:
+            running.discard(name)
+    return outermost_wrapper
+
+def instrument_functions(namespace: dict, prefix: str, name: str, exclude: tuple = ()):
+    """Replaces every function of a module namespace whose name starts with `prefix` by a timed version of it,
+    labeled with the function name. Only the outermost call is timed when these functions call each other."""
+    for function_name, function in list(namespace.items()):
+        if function_name.startswith(prefix) and function_name not in exclude and callable(function) and not hasattr(function, "__wrapped__"):
+            namespace[function_name] = timed_function(function, name, outermost=True, function=function_name)
+
+def snapshot() -> dict:
+    """Returns every metric as plain data, histograms as their count, sum and average."""
+    def labeled(name, labels):
+        return name + ("{" + ",".join(f"{key}={value}" for key, value in labels) + "}" if len(labels) > 0 else "")
+    with _lock:
+        data = {labeled(name, labels): value for (name, labels), value in _counters.items()}
+        data.update({labeled(name, labels): value for (name, labels), value in _gauges.items()})
+        for (name, labels), (_, total, count) in _histograms.items():
+            data[labeled(name, labels)] = {"count": count, "sum": round(total, 6), "avg": round(total / count, 6) if count > 0 else 0}
+    return data
+
+def render_prometheus() -> str:
+    def labeled(name, labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        return name + ("{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if len(labels) > 0 else "")
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append(f"{labeled(name, labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append(f"{labeled(name, labels)} {value}")
+        for (name, labels), (bucket_counts, total, count) in sorted(_histograms.items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip(_buckets, bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if upper_bound == float("inf") else str(upper_bound)
+                lines.append(f"{labeled(name + '_bucket', labels, (('le', le),))} {cumulative}")
+            lines.append(f"{labeled(name + '_sum', labels)} {total}")
+            lines.append(f"{labeled(name + '_count', labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the crawler output
+        pass
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves /metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics_http", daemon=True).start()
+    return server
+
+def start_log_reporter(interval: float, source: str = ""):
+    """Prints a JSON line with every metric every `interval` seconds, from a daemon thread."""
+    def report():
+        while True:
+            time.sleep(interval)
+            print(json.dumps({"metrics_time": time.strftime("%Y-%m-%dT%H:%M:%S"), "source": source, "metrics": snapshot()}), flush=True)
+    threading.Thread(target=report, name="metrics_log", daemon=True).start()
+
+def start(port: int = 0, log_interval: float = 0, source: str = ""):
+    """Starts the HTTP endpoint if `port` isn't 0 and the log reporter if `log_interval` isn't 0."""
+    if port > 0:
+        start_http_server(port)
+        print(f"[{source}] Metrics available at http://127.0.0.1:{port}/metrics")
+    if log_interval > 0:
+        start_log_reporter(log_interval, source)
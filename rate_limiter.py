@@ -0,0 +1,135 @@
+"""
+Token bucket rate limiter shared by every crawler process running on the same machine.
+The buckets and the daily quota are kept in a SQLite file, so they also survive restarts.
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+_create_buckets_stmt = "CREATE TABLE IF NOT EXISTS buckets ("\
+    "endpoint TEXT PRIMARY KEY, "\
+    "tokens REAL NOT NULL, "\
+    "last_refill REAL NOT NULL);"
+
+_create_daily_usage_stmt = "CREATE TABLE IF NOT EXISTS daily_key_usage ("\
+    "day TEXT NOT NULL, "\
+    "key_id TEXT NOT NULL, "\
+    "used INTEGER NOT NULL, "\
+    "PRIMARY KEY (day, key_id));"
+
+_get_bucket_stmt = "SELECT tokens, last_refill FROM buckets WHERE endpoint = ?;"
+
+_update_bucket_stmt = "INSERT INTO buckets (endpoint, tokens, last_refill) VALUES (?, ?, ?) "\
+    "ON CONFLICT(endpoint) DO UPDATE SET tokens = excluded.tokens, last_refill = excluded.last_refill;"
+
+_get_daily_usage_stmt = "SELECT used FROM daily_key_usage WHERE day = ? AND key_id = ?;"
+
+_increment_daily_usage_stmt = "INSERT INTO daily_key_usage (day, key_id, used) VALUES (?, ?, 1) "\
+    "ON CONFLICT(day, key_id) DO UPDATE SET used = used + 1;"
+
+# daily_usage is the table of the versions before per-key quotas, when every call was made with the same key
+_legacy_daily_usage_exists_stmt = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_usage';"
+
+# WHERE true tells SQLite the ON CONFLICT belongs to the INSERT and not to the SELECT
+_import_legacy_daily_usage_stmt = "INSERT INTO daily_key_usage (day, key_id, used) SELECT day, ?, used FROM daily_usage WHERE true "\
+    "ON CONFLICT(day, key_id) DO UPDATE SET used = used + excluded.used;"
+
+_drop_legacy_daily_usage_stmt = "DROP TABLE daily_usage;"
+
+
+def _seconds_until_next_day(now: datetime) -> float:
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class RateLimiter:
+    """Per-endpoint token buckets plus a daily quota, stored in a SQLite file.
+
+    Every budget is a dict with "max_num_queries" (the size of the bucket), "cooldown" (the seconds it
+    takes to refill the whole bucket) and "daily_quota" (whether the endpoint counts towards the daily quota).
+    Calls made with different API keys use different buckets and daily quotas.
+    """
+
+    def __init__(self, path: str, budgets: Dict[str, dict], daily_quota: int):
+        self.budgets = budgets
+        self.daily_quota = daily_quota
+        self._lock = threading.Lock()
+        # autocommit mode, transactions are opened by hand with BEGIN IMMEDIATE so only one process refills at a time
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute(_create_buckets_stmt)
+        self.connection.execute(_create_daily_usage_stmt)
+
+    def reserve(self, endpoint: str, key_id: str = "") -> Tuple[int, float]:
+        """Takes a token from the bucket of the endpoint, if there's one available.
+
+        Args:
+            endpoint (str): the name of the endpoint, as found in the budgets
+            key_id (str, optional): identifies the API key the call is made with. Defaults to "", calls without a key.
+
+        Returns:
+            Tuple[int, float]: the number of queries currently counted in the bucket, and the seconds
+            to wait before trying again (0 if the token was taken)
+        """
+        budget = self.budgets[endpoint]
+        bucket = endpoint if key_id == "" else f"{endpoint}@{key_id}"
+        capacity = budget["max_num_queries"]
+        refill_rate = capacity / budget["cooldown"]
+        with self._lock:
+            cur = self.connection.cursor()
+            cur.execute("BEGIN IMMEDIATE;")
+            try:
+                now = time.time()
+                cur.execute(_get_bucket_stmt, (bucket,))
+                row = cur.fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+
+                wait_time = 0.0
+                if budget.get("daily_quota", False):
+                    utc_now = datetime.fromtimestamp(now, tz=timezone.utc)
+                    day = utc_now.date().isoformat()
+                    cur.execute(_get_daily_usage_stmt, (day, key_id))
+                    used = cur.fetchone()
+                    if used is not None and used[0] >= self.daily_quota:
+                        wait_time = _seconds_until_next_day(utc_now)
+
+                if wait_time == 0.0:
+                    if tokens >= 1:
+                        tokens -= 1
+                        if budget.get("daily_quota", False):
+                            cur.execute(_increment_daily_usage_stmt, (day, key_id))
+                    else:
+                        wait_time = (1 - tokens) / refill_rate
+
+                cur.execute(_update_bucket_stmt, (bucket, tokens, now))
+                cur.execute("COMMIT;")
+            except Exception:
+                cur.execute("ROLLBACK;")
+                raise
+        return int(capacity - tokens), wait_time
+
+    def get_daily_usage(self, key_id: str = "") -> int:
+        day = datetime.now(tz=timezone.utc).date().isoformat()
+        with self._lock:
+            cur = self.connection.execute(_get_daily_usage_stmt, (day, key_id))
+            used = cur.fetchone()
+        return used[0] if used is not None else 0
+
+    def import_legacy_daily_usage(self, key_id: str):
+        """Moves the daily usage counted by versions before per-key quotas to the key `key_id`, the one they made every call with.
+        The old table is dropped in the same transaction, so the usage is only imported once."""
+        with self._lock:
+            cur = self.connection.cursor()
+            cur.execute("BEGIN IMMEDIATE;")
+            try:
+                cur.execute(_legacy_daily_usage_exists_stmt)
+                if cur.fetchone() is not None:
+                    cur.execute(_import_legacy_daily_usage_stmt, (key_id,))
+                    cur.execute(_drop_legacy_daily_usage_stmt)
+                cur.execute("COMMIT;")
+            except Exception:
+                cur.execute("ROLLBACK;")
+                raise
@@ -0,0 +1,75 @@
+"""
+This script re-fetches the details and review counts of the games that were retrieved the longest time ago.
+Only a budget of games is refreshed per run, and only the values that changed are written to the database.
+"""
+
+import json
+import time
+from database import *
+from crawl_app_data import fetch_appdetails, fetch_query_summary
+
+# unchanged games get their date_retrieved bumped in batches of this size
+_touch_batch_size = 100
+
+def refresh_game_details(budget=1000, max_age_days=30, most_reviewed_first=False, verbose=False):
+    """Refreshes up to `budget` games retrieved more than `max_age_days` days ago.
+
+    Args:
+        budget (int): the maximum number of games to refresh. Each one costs an appdetails and an appreviews request
+        max_age_days (int): games retrieved more recently than this are left alone
+        most_reviewed_first (bool): refresh the games with the most reviews first instead of the stalest ones
+
+    Returns:
+        Tuple[int, int]: the number of games checked and the number of games that changed
+    """
+    appids = get_stale_games(max_age_days, budget, most_reviewed_first)
+    print(f"Refreshing {len(appids)} games retrieved more than {max_age_days} days ago")
+    num_checked = 0
+    num_changed = 0
+    unchanged = []
+    query_count = 0
+    for appid in appids:
+        app_id = str(appid)
+        appdetails_text, query_count = fetch_appdetails(app_id, query_count)
+        appdata = json.loads(appdetails_text) if len(appdetails_text) > 0 else None
+        if appdata is None or not appdata[app_id]["success"]:
+            # the game got removed from the store or hidden, what we have is the last known data
+            if verbose:
+                print(f"No details for app ID {app_id}, keeping the stored ones")
+            unchanged.append(appid)
+        else:
+            query_summary, query_count = fetch_query_summary(app_id, query_count, verbose)
+            if refresh_game_data(appid, appdata[app_id]["data"], query_summary):
+                num_changed += 1
+                if verbose:
+                    print(f"App ID {app_id} updated")
+            else:
+                unchanged.append(appid)
+        num_checked += 1
+        if len(unchanged) >= _touch_batch_size:
+            touch_games(unchanged)
+            unchanged.clear()
+            print(f"Checked {num_checked} games, {num_changed} changed")
+    touch_games(unchanged)
+    return num_checked, num_changed
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refresh the details of the games that were retrieved the longest time ago.")
+    parser.add_argument("-b", "--budget", type=int, default=1000, help="Maximum number of games to refresh.")
+    parser.add_argument("-a", "--max-age-days", type=int, default=30, help="Only refresh games retrieved more than this many days ago.")
+    parser.add_argument("-p", "--popular", action="store_true", help="Refresh the games with the most reviews first instead of the stalest ones.")
+    parser.add_argument("--migrate", action="store_true", help="Add the date_retrieved indexes to a database created before the refreshes.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.migrate:
+        print("Adding the date_retrieved indexes of game_details and player_data...")
+        add_refresh_indexes()
+    try:
+        start_time = time.time()
+        num_checked, num_changed = refresh_game_details(args.budget, args.max_age_days, args.popular, args.verbose)
+        print(f"Done! Checked {num_checked} games, {num_changed} changed")
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected. Exiting...")
+    finally:
+        print("Total time:", time.time() - start_time, "seconds")
@@ -0,0 +1,79 @@
+"""
+This script refreshes the price of every game in the database.
+appdetails accepts many appids at once when it's filtered to price_overview, so a whole chunk of games costs one request.
+"""
+
+import json
+import time
+import transport
+from database import *
+from config import check_rate_limit
+
+def fetch_prices(appids):
+    """Fetches the price_overview of many apps with a single appdetails request.
+
+    Returns:
+        dict: appid (str) -> the appdetails entry of the app, {"success": bool, "data": {"price_overview": {...}} or []}
+    """
+    params = {"appids": ",".join(str(appid) for appid in appids), "filters": "price_overview", "cc": "us"}
+    consecutive_retries = 0
+    while True:
+        try:
+            check_rate_limit(0, "appdetails")
+            response = transport.get(transport.STORE_URL + "/api/appdetails", params=params)
+        except Exception as e:
+            print("Exception while requesting prices: " + str(e) + "\n")
+            consecutive_retries = min(consecutive_retries + 1, 3 * 5)
+            print(f"Waiting {(consecutive_retries * 20.0 / 60.0)} minute(s) before retrying...")
+            time.sleep(consecutive_retries * 20.0)
+            continue
+        if response.status_code == 200 and len(response.text) > 0:
+            return json.loads(response.text)
+        print(f"REST API error ({response.status_code}) while requesting prices: " + str(response.text))
+        consecutive_retries = min(consecutive_retries + 1, 3)
+        print(f"Waiting {((30.0 + consecutive_retries * 30.0) / 60.0)} minute(s) before retrying...")
+        time.sleep(30.0 + consecutive_retries * 30.0)
+
+def refresh_prices(chunk_size=200, verbose=False):
+    after_appid = 0
+    num_checked = 0
+    num_updated = 0
+    games = get_game_prices(after_appid, chunk_size)
+    while len(games) > 0:
+        after_appid = games[-1][0]
+        prices = fetch_prices([game[0] for game in games])
+        changed = []
+        for appid, price_usd, is_free in games:
+            app = prices.get(str(appid))
+            if app is None or not app["success"]:
+                if verbose:
+                    print(f"No price data for app ID {appid}")
+                continue
+            if isinstance(app["data"], dict) and "price_overview" in app["data"]:
+                new_price = (int(app["data"]["price_overview"]["final"]), False)
+            else:
+                # no price_overview: free, not released yet or not for sale. Only the price is known to be 0
+                new_price = (0, bool(is_free))
+            if new_price != (price_usd, bool(is_free)):
+                changed.append((new_price[0], new_price[1], appid))
+        update_game_prices(changed)
+        num_checked += len(games)
+        num_updated += len(changed)
+        print(f"Checked {num_checked} games, {num_updated} prices updated (last app ID: {after_appid})")
+        games = get_game_prices(after_appid, chunk_size)
+    return num_checked, num_updated
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Refresh the price of every game in the database.")
+    parser.add_argument("-c", "--chunk_size", type=int, default=200, help="Number of apps requested at once.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    try:
+        start_time = time.time()
+        refresh_prices(args.chunk_size, args.verbose)
+        print("Done!")
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt detected. Exiting...")
+    finally:
+        print("Total time:", time.time() - start_time, "seconds")
@@ -0,0 +1,83 @@
+"""
+On-disk cache for Steam responses that are expensive in rate limit budget, like appdetails and review summaries.
+Entries expire after a TTL, and the least recently used ones are evicted when the cache grows over its size limit.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+_create_responses_stmt = "CREATE TABLE IF NOT EXISTS responses ("\
+    "key TEXT PRIMARY KEY, "\
+    "value TEXT NOT NULL, "\
+    "size INTEGER NOT NULL, "\
+    "stored REAL NOT NULL, "\
+    "last_access REAL NOT NULL);"
+
+_create_last_access_index_stmt = "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);"
+
+_get_response_stmt = "SELECT value, stored FROM responses WHERE key = ?;"
+
+_touch_response_stmt = "UPDATE responses SET last_access = ? WHERE key = ?;"
+
+_put_response_stmt = "INSERT INTO responses (key, value, size, stored, last_access) VALUES (?, ?, ?, ?, ?) "\
+    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, stored = excluded.stored, last_access = excluded.last_access;"
+
+_delete_response_stmt = "DELETE FROM responses WHERE key = ?;"
+
+_delete_expired_stmt = "DELETE FROM responses WHERE stored < ?;"
+
+_get_total_size_stmt = "SELECT COALESCE(SUM(size), 0) FROM responses;"
+
+_get_least_recently_used_stmt = "SELECT key, size FROM responses ORDER BY last_access;"
+
+# eviction scans the table, so it only runs every few writes
+_evict_every = 100
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._puts_since_eviction = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.execute(_create_responses_stmt)
+        self.connection.execute(_create_last_access_index_stmt)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached value, or None if it's missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(_get_response_stmt, (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                self.connection.execute(_delete_response_stmt, (key,))
+                return None
+            self.connection.execute(_touch_response_stmt, (now, key))
+        return row[0]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self.connection.execute(_put_response_stmt, (key, value, len(value), now, now))
+            self._puts_since_eviction += 1
+            if self._puts_since_eviction >= _evict_every:
+                self._puts_since_eviction = 0
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self.connection.execute(_delete_expired_stmt, (now - self.ttl,))
+        excess = self.connection.execute(_get_total_size_stmt).fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.connection.execute(_get_least_recently_used_stmt):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.connection.executemany(_delete_response_stmt, evicted)
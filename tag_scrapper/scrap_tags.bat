@@ -1,2 +1,2 @@
-scrapy crawl tags -o output.jl
+scrapy crawl tags
 PAUSE
\ No newline at end of file
@@ -3,11 +3,66 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import sys
+import pandas as pd
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from twisted.internet.defer import DeferredList
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+# the database modules live in the root of the repository, two folders above the scrapy project
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 
 class TagScrapperPipeline:
+    """Writes the scraped tags to game_tags in batches while the crawl is still running.
+
+    The database connection is blocking, so batches are written by a thread pool with a single thread:
+    the reactor never waits on MySQL, and the connection is never used by two threads at once.
+    """
+
+    def __init__(self, batch_size, max_len):
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self._items = []
+        self._pending_writes = []
+        self._thread_pool = ThreadPool(minthreads=1, maxthreads=1, name="tag_scrapper_db")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.getint("TAGS_PIPELINE_BATCH_SIZE", 500), crawler.settings.getint("TAGS_MAX_LEN", 20))
+
+    def open_spider(self, spider):
+        # importing the database modules opens the MySQL connection
+        from insert_tags_from_scrapper import insert_tags_from_dataframe
+        self._insert_tags = insert_tags_from_dataframe
+        self._thread_pool.start()
+
     def process_item(self, item, spider):
+        self._items.append(ItemAdapter(item).asdict())
+        if len(self._items) >= self.batch_size:
+            self._flush(spider)
         return item
+
+    def close_spider(self, spider):
+        self._flush(spider)
+        # scrapy waits for the returned deferred before shutting down, so the last batches get written
+        return DeferredList(self._pending_writes).addBoth(lambda _: self._thread_pool.stop())
+
+    def _flush(self, spider):
+        if len(self._items) == 0:
+            return
+        # imported here so the reactor that gets used is the one installed by scrapy (TWISTED_REACTOR)
+        from twisted.internet import reactor
+        items = self._items
+        self._items = []
+        d = deferToThreadPool(reactor, self._thread_pool, self._write, items)
+        d.addErrback(lambda failure: spider.logger.error(f"Error while writing {len(items)} tag items: {failure.getErrorMessage()}"))
+        d.addBoth(lambda _: self._pending_writes.remove(d))
+        self._pending_writes.append(d)
+
+    def _write(self, items):
+        self._insert_tags(pd.DataFrame(items, columns=["appid", "requested_appid", "name", "tags"]), self.max_len, verbose=False)
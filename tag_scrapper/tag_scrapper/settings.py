@@ -62,9 +62,13 @@ DOWNLOAD_DELAY = 2
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "tag_scrapper.pipelines.TagScrapperPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "tag_scrapper.pipelines.TagScrapperPipeline": 300,
+}
+
+# Items written to the database per batch, and the number of tags the store shows at most (the priority of the first tag is 1, the last one 1/20)
+TAGS_PIPELINE_BATCH_SIZE = 500
+TAGS_MAX_LEN = 20
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -82,7 +86,11 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 4.0
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 HTTPCACHE_ENABLED = True
-HTTPCACHE_EXPIRATION_SECS = 0
+# Apps whose tags were scraped less than this many days ago are skipped
+TAG_REFRESH_DAYS = 7
+# Cached pages expire with the refresh window, and the RFC2616 policy revalidates them with conditional requests
+HTTPCACHE_EXPIRATION_SECS = TAG_REFRESH_DAYS * 24 * 60 * 60
+HTTPCACHE_POLICY = "scrapy.extensions.httpcache.RFC2616Policy"
 #HTTPCACHE_DIR = "httpcache"
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
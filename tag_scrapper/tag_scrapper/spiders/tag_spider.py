@@ -1,35 +1,94 @@
 import scrapy
 import os
+import sys
 import pandas as pd
 import logging
 
+# the database modules live in the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+
+# appids read from the database per query
+_appid_chunk_size = 1000
+
 class TagSpider(scrapy.Spider):
     name = 'tags'
     allowed_domains = ["steampowered.com"]
-    def start_requests(self):
-        # read urls from appids.csv
-        appids = []
-        bypass_age_cookies = {
-            'mature_content':'1',
-            'birthtime': '945730801',
-            'lastagecheckage': '21-0-2000'}
-        url = "https://store.steampowered.com/app/"
 
+    bypass_age_cookies = {
+        'mature_content':'1',
+        'wants_mature_content': '1',
+        'birthtime': '945730801',
+        'lastagecheckage': '21-0-2000'}
+    url = "https://store.steampowered.com/app/"
+
+    def __init__(self, appids_file=None, *args, **kwargs):
+        # scrapy crawl tags -a appids_file=appids.csv scrapes the appids of a file instead of the ones in the database
+        super().__init__(*args, **kwargs)
+        self.appids_file = appids_file
+        # the age gate is passed once per crawl, the cookie middleware sends the cookies it sets with every later request
+        self._verifying_age = False
+        # (appid, age checks) of the apps that got the age gate while it was being passed
+        self._waiting_for_age_check = []
+
+    def read_appids(self):
+        if self.appids_file is not None:
+            try:
+                appids = pd.read_csv(self.appids_file, encoding='utf-8-sig')
+            except FileNotFoundError:
+                print(self.appids_file + " not found. Make sure it's in this directory: " + os.getcwd())
+                return []
+            return appids['appid'].astype(str).tolist()
+        from database_internal import internal_connect, internal_get_apps_without_fresh_tags
+        # its own connection, the pipeline writes with the other one from its thread
+        own_connection = internal_connect()
+        max_age_days = self.settings.getint("TAG_REFRESH_DAYS", 7)
+        all_appids = []
         try:
-            appids = pd.read_csv('appids.csv', encoding='utf-8-sig')
-            appids = appids['appid'].astype(str).tolist()
-        except FileNotFoundError:
-            print("appids.csv not found. Make sure it's in this directory: " + os.getcwd())
-            return
-        
-        for appid in appids:
-            yield scrapy.Request(url=url + appid, cookies=bypass_age_cookies, callback=self.parse_tags)
+            after_appid = 0
+            appids = internal_get_apps_without_fresh_tags(own_connection, after_appid, max_age_days, _appid_chunk_size)
+            while len(appids) > 0:
+                all_appids.extend(str(appid) for appid in appids)
+                after_appid = appids[-1]
+                appids = internal_get_apps_without_fresh_tags(own_connection, after_appid, max_age_days, _appid_chunk_size)
+        finally:
+            own_connection.close()
+        return all_appids
+
+    def app_request(self, appid, age_checks=0):
+        # dont_filter: apps that got the age gate are requested again.
+        # The store redirects some apps to another appid, requested_appid is the one whose tags_retrieved gets stamped
+        return scrapy.Request(url=self.url + appid, cookies=self.bypass_age_cookies, callback=self.parse_tags,
+                              meta={'age_checks': age_checks, 'requested_appid': appid}, dont_filter=age_checks > 0)
+
+    def start_requests(self):
+        # every appid is read before the first request, the queries are blocking and would stall the reactor in the middle of the crawl.
+        # Even the whole catalog is only a few hundred thousand appids
+        for appid in self.read_appids():
+            yield self.app_request(appid)
 
     def parse_tags(self, response):
         if '/agecheck/app' in response.url:
-            g_sessionid = response.xpath('//script[contains(text(), "g_sessionID")]/text()').extract_first().split('"')[1]
+            # https://store.steampowered.com/agecheck/app/<appid>/
+            appid = response.url.split('/')[5]
+            requested_appid = response.meta.get('requested_appid', appid)
+            age_checks = response.meta.get('age_checks', 0)
+            if age_checks >= 2:
+                logging.warning(f"App {appid} still gets the age gate after passing it, skipping")
+                return
+            if self._verifying_age:
+                self._waiting_for_age_check.append((requested_appid, age_checks + 1))
+                return
+            # either the first mature app of the crawl or the session expired
+            g_sessionid_script = response.xpath('//script[contains(text(), "g_sessionID")]/text()').extract_first()
+            if g_sessionid_script is None:
+                # the flag stays unset, so the next mature app tries to pass the age gate again
+                logging.warning(f"No g_sessionID in the age gate of app {appid}, skipping")
+                return
+            g_sessionid = g_sessionid_script.split('"')[1]
+            self._verifying_age = True
+            self._waiting_for_age_check.append((requested_appid, age_checks + 1))
             yield scrapy.FormRequest(
-                url='https://store.steampowered.com/agecheckset/' + "app" + "/" + response.url.split('/')[4],
+                url='https://store.steampowered.com/agecheckset/' + "app" + "/" + appid,
                 method='POST',
                 formdata={ 
                     'sessionid': g_sessionid,
@@ -37,11 +96,21 @@ class TagSpider(scrapy.Spider):
                     'ageMonth': '2',
                     'ageYear': '2000'
                 },
-                callback=self.parse_tags
+                callback=self.age_verified,
+                errback=self.age_verified,
+                dont_filter=True
             )
         else:
             yield {
                 'appid': response.url.split('/')[4],
+                'requested_appid': response.meta.get('requested_appid'),
                 'name': response.css('div.apphub_AppName::text').extract_first(), # useful for debugging
                 'tags': [tag.strip() for tag in response.css('a.app_tag::text').extract() if tag != '+']
-            }
\ No newline at end of file
+            }
+
+    def age_verified(self, response_or_failure):
+        self._verifying_age = False
+        waiting = self._waiting_for_age_check
+        self._waiting_for_age_check = []
+        for appid, age_checks in waiting:
+            yield self.app_request(appid, age_checks)
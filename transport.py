@@ -0,0 +1,70 @@
+"""
+HTTP transport used for every call to Steam: a single keep-alive session with a connection pool per host,
+gzip, connect/read timeouts and one retry policy for connection errors and 5xx responses.
+429 and 403 responses aren't retried here, they're handled by the callers and the API key pool.
+"""
+
+import time
+import requests
+from decouple import config
+from requests import exceptions  # lets this module stand in for requests inside steamreviews
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+import metrics
+
+_steam_api_url = "https://api.steampowered.com"
+_steam_store_url = "https://store.steampowered.com"
+
+# STEAM_API_URL and STEAM_STORE_URL point the crawlers to another server, like the fake one of the benchmarks
+API_URL = config("STEAM_API_URL", default=_steam_api_url)
+STORE_URL = config("STEAM_STORE_URL", default=_steam_store_url)
+
+# (connect, read) seconds. Steam can take a while to answer big requests like GetAppList, but never minutes
+DEFAULT_TIMEOUT = (5, 60)
+
+# connections kept open per host, enough for the threads of asyncio's default executor
+_pool_size = 32
+
+_retry_policy = Retry(
+    total=3,
+    backoff_factor=2,  # 2, 4, 8 seconds
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=("GET", "POST"),
+    respect_retry_after_header=True,
+    raise_on_status=False,  # the last response is returned, callers already check status_code
+)
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_pool_size, max_retries=_retry_policy)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+session = _create_session()
+
+def _endpoint_label(url) -> str:
+    # /appreviews/<appid> is one endpoint for every app, not one per app
+    return "/".join(segment for segment in urlsplit(url).path.split("/") if not segment.isdigit()).rstrip("/")
+
+def request(method, url, params=None, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    if STORE_URL != _steam_store_url and url.startswith(_steam_store_url):
+        # steamreviews builds its own store URLs
+        url = STORE_URL + url[len(_steam_store_url):]
+    endpoint = _endpoint_label(url)
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, params=params, timeout=timeout, **kwargs)
+    except Exception:
+        metrics.inc("steam_requests_total", endpoint=endpoint, status="exception")
+        raise
+    finally:
+        # includes the retries of the retry policy, which is the time the caller actually waited
+        metrics.observe("steam_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+    metrics.inc("steam_requests_total", endpoint=endpoint, status=str(response.status_code))
+    return response
+
+def get(url, params=None, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    return request("GET", url, params=params, timeout=timeout, **kwargs)